@@ -2,6 +2,7 @@
 from dependency_injector import containers, providers
 
 from server.engine.Container import EngineContainer
+from server.payload.SR.Encoder import SREncoder
 
 
 class Application(containers.DeclarativeContainer):
@@ -11,3 +12,5 @@ class Application(containers.DeclarativeContainer):
     setting = providers.Dependency()
 
     engine_container = providers.Container(EngineContainer, setting=setting)
+
+    sr_encoder = providers.Singleton(SREncoder, setting=setting.provided.sr)
@@ -0,0 +1,98 @@
+"""Completion registry module."""
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, Union
+from uuid import UUID
+
+from loguru import logger
+
+from server.base.Message import BaseFailed, BaseResult
+from server.util.util import create_timestamp
+
+# Receives partial results of a task; returns False once the consumer is gone
+PartialListener = Callable[[BaseResult], bool]
+
+
+class CompletionRegistry:
+    """Pending task futures keyed by `BaseTask.id`.
+
+    Results are routed by `task_id` only, so a worker may hold any number of
+    outstanding tasks without one caller receiving another caller's result.
+    """
+
+    __futures: Dict[UUID, Future]
+    __registered_at: Dict[UUID, int]
+    __listeners: Dict[UUID, PartialListener]
+    __lock: threading.Lock
+
+    def __init__(self):
+        self.__futures = {}
+        self.__registered_at = {}
+        self.__listeners = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__futures)
+
+    def __contains__(self, task_id: UUID) -> bool:
+        with self.__lock:
+            return task_id in self.__futures
+
+    def register(self, task_id: UUID, listener: PartialListener = None) -> Future:
+        future = Future()
+        with self.__lock:
+            if task_id in self.__futures:
+                raise RuntimeError(f"Task `{task_id}` already registered")
+            self.__futures[task_id] = future
+            self.__registered_at[task_id] = create_timestamp()
+            if listener is not None:
+                self.__listeners[task_id] = listener
+        return future
+
+    def registered_at(self, task_id: UUID) -> Optional[int]:
+        with self.__lock:
+            return self.__registered_at.get(task_id)
+
+    def discard(self, task_id: UUID):
+        with self.__lock:
+            self.__futures.pop(task_id, None)
+            self.__registered_at.pop(task_id, None)
+            self.__listeners.pop(task_id, None)
+
+    def publish(self, msg: BaseResult) -> bool:
+        """Deliver a partial result; False if the task was cancelled or abandoned."""
+        with self.__lock:
+            future = self.__futures.get(msg.task_id)
+            listener = self.__listeners.get(msg.task_id)
+
+        if future is None or future.cancelled():
+            return False
+
+        if listener is None:
+            return True
+
+        return listener(msg)
+
+    def resolve(self, msg: Union[BaseResult, BaseFailed]) -> bool:
+        with self.__lock:
+            future = self.__futures.pop(msg.task_id, None)
+            self.__registered_at.pop(msg.task_id, None)
+            self.__listeners.pop(msg.task_id, None)
+
+        if future is None:
+            logger.warning(f"Dropped result for unknown task `{msg.task_id}`")
+            return False
+
+        if not future.set_running_or_notify_cancel():
+            return False
+
+        future.set_result(msg)
+        return True
+
+    def fail_all(self):
+        with self.__lock:
+            task_ids = list(self.__futures.keys())
+
+        for task_id in task_ids:
+            self.resolve(BaseFailed(task_id=task_id))
@@ -1,6 +1,6 @@
 """Base Engine module."""
 from abc import ABCMeta, abstractmethod
-from typing import Union
+from typing import Any, Dict, List, Union
 
 from server.base.Message import BaseFailed, BaseResult, BaseTask
 
@@ -10,6 +10,10 @@ class BaseEngine(metaclass=ABCMeta):
     def process(self, task: BaseTask) -> Union[BaseResult, BaseFailed]:
         pass
 
+    @abstractmethod
+    async def submit(self, task: BaseTask) -> Union[BaseResult, BaseFailed]:
+        pass
+
     @abstractmethod
     def stop(self):
         pass
@@ -17,3 +21,7 @@ class BaseEngine(metaclass=ABCMeta):
     @abstractmethod
     def isReady(self) -> bool:
         pass
+
+    @abstractmethod
+    def metrics(self) -> List[Dict[str, Any]]:
+        pass
@@ -0,0 +1,69 @@
+"""ModelRegistry module."""
+import threading
+from typing import Callable, Dict, Generic, TypeVar
+
+from loguru import logger
+
+from server.util.types import EngineDevice
+
+T = TypeVar("T")
+
+
+class ModelRegistry(Generic[T]):
+    """Share one model instance per device between the workers on it.
+
+    The first `acquire` for a device builds the model with `factory`, while
+    concurrent callers for the same device wait for it instead of loading a
+    second copy. The model is dropped once every worker has released it.
+    """
+
+    __factory: Callable[[EngineDevice], T]
+    __models: Dict[str, T]
+    __refs: Dict[str, int]
+    __locks: Dict[str, threading.Lock]
+    __lock: threading.Lock
+
+    def __init__(self, factory: Callable[[EngineDevice], T]):
+        self.__factory = factory
+        self.__models = {}
+        self.__refs = {}
+        self.__locks = {}
+        self.__lock = threading.Lock()
+
+    def acquire(self, device: EngineDevice) -> T:
+        key = str(device)
+        with self.__lock:
+            load_lock = self.__locks.setdefault(key, threading.Lock())
+
+        # Loading holds only the lock of its own device
+        with load_lock:
+            with self.__lock:
+                model = self.__models.get(key)
+
+            if model is None:
+                model = self.__factory(device)
+                logger.info(f"[{self.__class__.__name__}] Model loaded on {key}")
+
+            with self.__lock:
+                self.__models[key] = model
+                self.__refs[key] = self.__refs.get(key, 0) + 1
+            return model
+
+    def release(self, device: EngineDevice):
+        key = str(device)
+        with self.__lock:
+            refs = self.__refs.get(key, 0) - 1
+            if refs > 0:
+                self.__refs[key] = refs
+                return
+
+            self.__refs.pop(key, None)
+            self.__models.pop(key, None)
+
+    def refs(self, device: EngineDevice) -> int:
+        with self.__lock:
+            return self.__refs.get(str(device), 0)
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__models)
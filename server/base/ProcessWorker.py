@@ -0,0 +1,332 @@
+"""Process worker module."""
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty, Full
+from typing import Any, Dict, Optional, Type
+from uuid import UUID
+
+import numpy as np
+from attrs import define
+from loguru import logger
+
+from server.base.Completion import PartialListener
+from server.base.Message import BaseMessage, BaseTask
+from server.base.Worker import BaseWorker
+from server.util.types import EngineDevice
+
+# Arrays at least this large are passed through shared memory, not the pipe.
+# Engine tasks carry their images and videos as bytes or paths and are
+# pickled whole, only the arrays of results are large enough
+SHARED_MEMORY_THRESHOLD = 64 * 1024
+
+# Interval (s) at which the receiver checks the process is still alive
+LIVENESS_INTERVAL = 1.0
+
+TASK = "task"
+ACK = "ack"
+READY = "ready"
+FAILED = "failed"
+PARTIAL = "partial"
+RESULT = "result"
+STOPPED = "stopped"
+
+
+@define
+class SharedArray:
+    name: str
+    shape: tuple
+    dtype: str
+
+
+def share_arrays(msg: BaseMessage) -> BaseMessage:
+    """Move large array fields of `msg` into shared memory blocks.
+
+    Blocks are owned by the receiving process, which frees them in
+    `restore_arrays`. They are untracked here so the resource tracker of
+    the creator neither warns about them nor unlinks them a second time.
+    """
+    update = {}
+    for key, value in msg.__dict__.items():
+        if isinstance(value, np.ndarray) and value.nbytes >= SHARED_MEMORY_THRESHOLD:
+            shm = SharedMemory(create=True, size=value.nbytes)
+            resource_tracker.unregister(shm._name, "shared_memory")
+            np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)[...] = value
+            update[key] = SharedArray(
+                name=shm.name, shape=value.shape, dtype=value.dtype.str
+            )
+            shm.close()
+    return msg.copy(update=update) if update else msg
+
+
+def restore_arrays(msg: BaseMessage, copy: bool = True) -> BaseMessage:
+    """Copy shared array fields of `msg` back and free their blocks.
+
+    With `copy=False` the blocks are only freed, for messages never delivered.
+    """
+    update = {}
+    for key, value in msg.__dict__.items():
+        if isinstance(value, SharedArray):
+            try:
+                shm = SharedMemory(name=value.name)
+            except FileNotFoundError:
+                logger.warning(f"Shared memory block `{value.name}` already freed")
+                continue
+
+            try:
+                if copy:
+                    update[key] = np.ndarray(
+                        value.shape, dtype=np.dtype(value.dtype), buffer=shm.buf
+                    ).copy()
+            finally:
+                shm.close()
+                shm.unlink()
+    return msg.copy(update=update) if update else msg
+
+
+def drain(events: multiprocessing.Queue):
+    """Free the blocks of the messages left in `events`."""
+    while True:
+        try:
+            item = events.get(timeout=0.1)
+        except Empty:
+            return
+
+        if item is None:
+            continue
+
+        kind, payload = item
+        if kind == RESULT:
+            payload = payload[0]
+        if isinstance(payload, BaseMessage):
+            restore_arrays(payload, copy=False)
+
+
+def serve(
+    worker_type: Type[BaseWorker],
+    kwargs: Dict[str, Any],
+    tasks: multiprocessing.Queue,
+    events: multiprocessing.Queue,
+):
+    """Entry point of the worker process, runs `worker_type(**kwargs)`."""
+    # The worker owns the process, its main thread runs with the same threads
+    if kwargs.get("threads") is not None:
+        kwargs["threads"].apply_process()
+
+    worker = worker_type(**kwargs)
+    worker.start()
+    while not worker.isReady():
+        time.sleep(0.01)
+
+    if worker.is_stopped:
+        worker.join()
+        events.put((FAILED, None))
+        return
+    events.put((READY, None))
+
+    # Partials wait for the parent to deliver them, so a slow consumer holds
+    # back the worker as it does in the server process
+    acks: Dict[UUID, queue.Queue] = {}
+    lock = threading.Lock()
+    stopping = False
+
+    def listen(msg: BaseMessage) -> bool:
+        with lock:
+            if stopping:
+                return False
+            reply = acks.setdefault(msg.task_id, queue.Queue())
+        events.put((PARTIAL, share_arrays(msg)))
+        return reply.get()
+
+    def done(future):
+        msg = future.result()
+        with lock:
+            acks.pop(msg.task_id, None)
+        # Latency as of the previous message, this one is still being handled
+        events.put((RESULT, (share_arrays(msg), worker.latency)))
+
+    while True:
+        item = tasks.get()
+        if item is None:
+            break
+
+        kind, payload = item
+        if kind == ACK:
+            task_id, accepted = payload
+            with lock:
+                reply = acks.get(task_id)
+            if reply is not None:
+                reply.put(accepted)
+            continue
+
+        future = worker.submit(restore_arrays(payload), listener=listen)
+        future.add_done_callback(done)
+
+    # Release listeners still waiting for an ack that will never come
+    with lock:
+        stopping = True
+        for reply in acks.values():
+            reply.put(False)
+
+    worker.stop()
+    worker.join()
+    events.put((STOPPED, None))
+
+
+class ProcessWorker(BaseWorker):
+    """Run a worker in its own process, behind the `BaseWorker` API.
+
+    CPU bound stages (decoding, pre/post-processing, encoding) then scale
+    with cores instead of contending on the GIL of the server process. This
+    thread relays tasks to the process and routes its partial and final
+    results into the local registry, so scheduling, metrics and streaming
+    behave as with thread workers. Models cannot be shared across processes.
+    A `threads` allocation in `kwargs` is applied by the worker in the child.
+
+    At most `queue_size` tasks are in flight in the process. Partials are
+    delivered by their own thread and acknowledged to the process, so a
+    blocked listener never holds back the results of other tasks.
+    """
+
+    __process: multiprocessing.Process
+    __tasks: multiprocessing.Queue
+    __events: multiprocessing.Queue
+    __partials: queue.Queue
+    __slots: Optional[threading.BoundedSemaphore]
+    __receiver: threading.Thread
+    __publisher: threading.Thread
+
+    def __init__(
+        self,
+        worker_type: Type[BaseWorker],
+        device: EngineDevice = None,
+        queue_size: int = 100,
+        **kwargs,
+    ):
+        if device is None:
+            device = EngineDevice()
+
+        super().__init__(queue_size=queue_size, device=device)
+        self.__slots = (
+            threading.BoundedSemaphore(queue_size) if queue_size > 0 else None
+        )
+
+        # `spawn` keeps CUDA and the server's threads out of the child
+        context = multiprocessing.get_context("spawn")
+        self.__tasks = context.Queue()
+        self.__events = context.Queue()
+        self.__partials = queue.Queue()
+
+        # The bound is enforced by `submit`, the process queue never rejects
+        kwargs = dict(kwargs, device=device, queue_size=-1)
+        self.__process = context.Process(
+            target=serve,
+            args=(worker_type, kwargs, self.__tasks, self.__events),
+            daemon=True,
+        )
+        self.__receiver = threading.Thread(target=self.__receive, daemon=True)
+        self.__publisher = threading.Thread(target=self.__publish, daemon=True)
+
+    def submit(self, task: BaseTask, listener: PartialListener = None) -> Future:
+        """Raises `queue.Full` once `queue_size` tasks are in the process."""
+        if self.__slots is not None and not self.__slots.acquire(blocking=False):
+            raise Full
+
+        try:
+            return super().submit(task, listener=listener)
+        except Full:
+            self.__slots.release()
+            raise
+
+    def init(self):
+        self.__process.start()
+
+        while True:
+            try:
+                kind, _ = self.__events.get(timeout=LIVENESS_INTERVAL)
+                break
+            except Empty:
+                if not self.__process.is_alive():
+                    raise RuntimeError("Worker process exited during init")
+
+        if kind != READY:
+            self.__process.join()
+            raise RuntimeError("Worker process failed to init")
+
+        self.__receiver.start()
+        self.__publisher.start()
+        logger.info(f"[{self.__class__.__name__}] pid {self.__process.pid} ready")
+
+    def handle(self, msg: BaseMessage):
+        self.__tasks.put((TASK, share_arrays(msg)))
+
+    def dispatch(self, msg: BaseMessage):
+        # Forwarding takes no time, latency comes with the results
+        self.handle(msg)
+
+    def __receive(self):
+        while True:
+            try:
+                kind, payload = self.__events.get(timeout=LIVENESS_INTERVAL)
+            except Empty:
+                if self.__process.is_alive():
+                    continue
+
+                logger.warning(
+                    f"[{self.__class__.__name__}] pid {self.__process.pid} "
+                    f"exited with code {self.__process.exitcode}"
+                )
+                self.stop()
+                self.registry.fail_all()
+                break
+
+            if kind == STOPPED:
+                break
+
+            if kind == PARTIAL:
+                self.__partials.put(restore_arrays(payload))
+                continue
+
+            # Service times are measured by the worker in the process
+            msg, latency = payload
+            if latency is not None:
+                self.latency = latency
+            self.emit(restore_arrays(msg))
+            if self.__slots is not None:
+                self.__slots.release()
+
+    def __publish(self):
+        while True:
+            msg = self.__partials.get()
+            if msg is None:
+                break
+
+            accepted = self.publish(msg)
+            self.__tasks.put((ACK, (msg.task_id, accepted)))
+
+    def release(self):
+        # Let the process finish in-flight tasks before anything is failed
+        if self.__process.is_alive():
+            self.__tasks.put(None)
+            self.__process.join()
+
+        # Also stops the receiver if the process died without saying so
+        self.__events.put((STOPPED, None))
+        if self.__receiver.is_alive():
+            self.__receiver.join()
+        self.__partials.put(None)
+        if self.__publisher.is_alive():
+            self.__publisher.join()
+
+        # Free the blocks of messages neither side will read anymore
+        drain(self.__tasks)
+        drain(self.__events)
+
+    def metrics(self) -> Dict[str, Any]:
+        metrics = super().metrics()
+        metrics["pid"] = self.__process.pid
+        return metrics
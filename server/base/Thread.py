@@ -37,6 +37,10 @@ class BaseThread(threading.Thread):
     def handle(self, msg: BaseModel):
         pass
 
+    def dispatch(self, msg: BaseModel):
+        """Called by the thread loop for every message, runs `handle`."""
+        self.handle(msg)
+
     def run(self):
         try:
             self.init()
@@ -59,7 +63,7 @@ class BaseThread(threading.Thread):
                 continue
 
             try:
-                self.handle(msg)
+                self.dispatch(msg)
             except Exception as err:
                 logger.warning(err)
                 tb = traceback.format_tb(err.__traceback__)
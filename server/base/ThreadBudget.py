@@ -0,0 +1,148 @@
+"""ThreadBudget module."""
+import contextlib
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Union
+
+import cv2
+import onnxruntime
+import torch
+from attrs import define
+from loguru import logger
+
+from server.util.cpuinfo import get_cpu_info
+
+
+@lru_cache(maxsize=1)
+def available_cpus() -> List[int]:
+    """CPUs this process may run on, at most the core count of cpuinfo."""
+    count = get_cpu_info().get("count") or os.cpu_count() or 1
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS and Windows
+        cpus = list(range(count))
+    return cpus[:count]
+
+
+@define
+class ThreadAllocation:
+    """Threads granted to one worker by the `ThreadBudget`."""
+
+    intra_op: int = 1  # torch and onnxruntime intra-op threads
+    inter_op: int = 1  # onnxruntime inter-op threads
+    opencv: int = 1  # OpenCV threads, process wide
+    cpus: Optional[List[int]] = None  # CPU affinity, None to leave unpinned
+
+    def apply(self):
+        """Apply to the calling thread, before it loads any model.
+
+        Affinity is inherited by the threads it creates afterwards (e.g. the
+        pools of sessions it builds). `cv2.setNumThreads` is process wide, so
+        every allocation of a budget carries the same OpenCV value. torch
+        keeps an intra-op team per calling thread, sized here for this one.
+        """
+        torch.set_num_threads(self.intra_op)
+        cv2.setNumThreads(self.opencv)
+        if self.cpus:
+            os.sched_setaffinity(0, self.cpus)
+
+    def apply_process(self):
+        """Size the torch intra-op team of the main thread of the process."""
+        torch.set_num_threads(self.intra_op)
+
+    @contextlib.contextmanager
+    def pinned(self):
+        """Temporarily run the calling thread on `cpus`."""
+        if not self.cpus:
+            yield
+            return
+
+        previous = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, self.cpus)
+        try:
+            yield
+        finally:
+            os.sched_setaffinity(0, previous)
+
+    def configure(self, options: onnxruntime.SessionOptions):
+        options.intra_op_num_threads = self.intra_op
+        options.inter_op_num_threads = self.inter_op
+
+    @staticmethod
+    def merge(allocations: List["ThreadAllocation"]) -> "ThreadAllocation":
+        """Allocation of a model shared by the workers of `allocations`."""
+        cpus = sorted({cpu for a in allocations if a.cpus for cpu in a.cpus})
+        return ThreadAllocation(
+            intra_op=sum(a.intra_op for a in allocations),
+            inter_op=max(a.inter_op for a in allocations),
+            opencv=allocations[0].opencv,
+            cpus=cpus or None,
+        )
+
+
+class ThreadBudget:
+    """Split the CPU cores between the workers of every engine.
+
+    Without a budget each worker runs torch, onnxruntime and OpenCV with one
+    thread per core, so N workers oversubscribe the machine N times. GPU
+    workers mostly wait for their device and get a single core each, the
+    rest is divided evenly between CPU workers. With `pin`, workers are also
+    given disjoint sets of CPUs.
+    """
+
+    __cpus: List[int]
+    __pin: bool
+
+    def __init__(self, cores: int = None, pin: bool = False, cpus: List[int] = None):
+        """Budget `cpus` (default: `available_cpus()`), or only `cores` of them."""
+        if cpus is None:
+            cpus = available_cpus()
+        if cores is not None:
+            cpus = cpus[: max(cores, 1)]
+        self.__cpus = cpus
+        self.__pin = pin
+
+    @property
+    def cores(self) -> int:
+        return len(self.__cpus)
+
+    def allocate(
+        self, pools: Dict[str, List[Union[int, str]]]
+    ) -> Dict[str, List[ThreadAllocation]]:
+        """Allocate threads to the workers of `pools`, given by their device id.
+
+        Allocations only depend on their arguments, so every engine computes
+        the same global plan from the settings and takes its own pool.
+        """
+        workers = [(pool, dev) for pool, devices in pools.items() for dev in devices]
+        num_gpu = sum(1 for _, dev in workers if dev != "cpu")
+        num_cpu = len(workers) - num_gpu
+
+        remaining = max(self.cores - num_gpu, num_cpu)
+        opencv = max(self.cores // max(len(workers), 1), 1)
+
+        allocations: Dict[str, List[ThreadAllocation]] = {pool: [] for pool in pools}
+        offset = 0
+        cpu_index = 0
+        for pool, dev in workers:
+            if dev == "cpu":
+                # Earlier workers take the remainder of an uneven split
+                threads = remaining // num_cpu + (cpu_index < remaining % num_cpu)
+                cpu_index += 1
+            else:
+                threads = 1
+
+            cpus = None
+            if self.__pin:
+                cpus = [self.__cpus[(offset + i) % self.cores] for i in range(threads)]
+            offset += threads
+
+            allocations[pool].append(
+                ThreadAllocation(intra_op=threads, inter_op=1, opencv=opencv, cpus=cpus)
+            )
+
+        logger.info(
+            f"[{self.__class__.__name__}] {self.cores} cores for "
+            f"{num_cpu} CPU and {num_gpu} GPU workers"
+        )
+        return allocations
@@ -1,16 +1,106 @@
 """Worker module."""
-from queue import Queue
+from concurrent.futures import Future
+from queue import Full
+from typing import Any, Dict, Optional, Union
 
+from server.base.Completion import CompletionRegistry, PartialListener
+from server.base.Message import BaseFailed, BaseResult, BaseTask
 from server.base.Thread import BaseThread
+from server.base.ThreadBudget import ThreadAllocation
 from server.util.types import EngineDevice
+from server.util.util import calculate_ewma, create_timestamp
 
 
 class BaseWorker(BaseThread):
     device: EngineDevice
-    sink: Queue
+    threads: Optional[ThreadAllocation]
+    registry: CompletionRegistry
     id: str
 
-    def __init__(self, queue_size: int, device: EngineDevice):
+    latency: Optional[int]  # EWMA of per-task service time (ms)
+    emitted: int  # Tasks resolved by `emit` so far
+
+    def __init__(
+        self,
+        queue_size: int,
+        device: EngineDevice,
+        threads: ThreadAllocation = None,
+    ):
         super().__init__(queue_size)
         self.device = device
-        self.sink = Queue()
+        self.threads = threads
+        self.registry = CompletionRegistry()
+        self.latency = None
+        self.emitted = 0
+
+    def submit(self, task: BaseTask, listener: PartialListener = None) -> Future:
+        """Push a task without blocking and return a future resolved by this worker.
+
+        Partial results published while the task runs are passed to `listener`.
+        Raises `queue.Full` when the worker queue is bounded and saturated.
+        Tasks submitted to a stopped worker (or one whose `init` failed) fail
+        at once.
+        """
+        future = self.registry.register(task.id, listener=listener)
+
+        try:
+            self.queue.put_nowait(task)
+        except Full:
+            self.registry.discard(task.id)
+            raise
+
+        # Checked after registering: a stop either sees the task in
+        # `fail_all`, or happened before this check
+        if self.is_stopped:
+            self.registry.resolve(BaseFailed(task_id=task.id))
+        return future
+
+    def emit(self, msg: Union[BaseResult, BaseFailed]):
+        if self.registry.resolve(msg):
+            self.emitted += 1
+
+    def dispatch(self, msg: BaseTask):
+        """Sample the service time of the tasks `handle` resolves.
+
+        Tasks batched by one call share its time, so the sample is that time
+        divided by their number, whatever order they are emitted in.
+        """
+        emitted = self.emitted
+        started_at = create_timestamp()
+        try:
+            super().dispatch(msg)
+        finally:
+            count = self.emitted - emitted
+            if count > 0:
+                elapsed = create_timestamp() - started_at
+                self.latency = calculate_ewma(self.latency, elapsed // count)
+
+    def publish(self, msg: BaseResult) -> bool:
+        return self.registry.publish(msg)
+
+    def outstanding(self) -> int:
+        return len(self.registry)
+
+    def expected_work(self) -> int:
+        """Expected time (ms) until a task submitted now would be done."""
+        return (self.outstanding() + 1) * (self.latency or 0)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "device": str(self.device),
+            "outstanding": self.outstanding(),
+            "latency": self.latency,
+            "threads": self.threads.intra_op if self.threads is not None else None,
+        }
+
+    def release(self):
+        """Free what `init` acquired, called once the worker has stopped."""
+        pass
+
+    def run(self):
+        if self.threads is not None:
+            self.threads.apply()
+        super().run()
+        self.release()
+        self.registry.fail_all()
@@ -1,21 +1,26 @@
 """BaseWorkerManager module."""
 import threading
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from loguru import logger
 
+from server.base.ThreadBudget import ThreadAllocation
 from server.base.Worker import BaseWorker
-from server.util.types import EngineDevice
+from server.util.types import EngineDevice, SchedulePolicy
 
 
 class BaseWorkerManager:
     devices: Tuple[EngineDevice]
+    worker_devices: Tuple[EngineDevice]
+    worker_threads: Tuple[Optional[ThreadAllocation]]
     workers: Tuple[BaseWorker]
 
     worker_num: int
     worker_index: int
     worker_queue_size: int
 
+    policy: SchedulePolicy
+
     lock: threading.Lock
 
     def __init__(
@@ -23,20 +28,51 @@ class BaseWorkerManager:
         worker_num: int = 1,
         devices: Tuple[EngineDevice] = None,
         queue_size: int = -1,
+        policy: SchedulePolicy = SchedulePolicy.ROUND_ROBIN,
+        worker_devices: Tuple[EngineDevice] = None,
+        worker_threads: List[ThreadAllocation] = None,
     ):
+        """Workers are spread round-robin over `devices`, unless
+        `worker_devices` gives the device of every worker explicitly.
+        `worker_threads` optionally gives the thread allocation of each worker.
+        """
         self.worker_index = 0
         self.lock = threading.Lock()
 
-        self.worker_num = worker_num
         self.worker_queue_size = queue_size
-
-        self.devices = devices
-
-        if self.devices is None or len(self.devices) <= 0:
-            self.devices = [EngineDevice()]
+        self.policy = policy
+
+        if worker_devices:
+            self.worker_devices = tuple(worker_devices)
+            devices: Dict[str, EngineDevice] = {}
+            for device in self.worker_devices:
+                devices.setdefault(str(device), device)
+            self.devices = tuple(devices.values())
+        else:
+            self.devices = devices
+            if self.devices is None or len(self.devices) <= 0:
+                self.devices = [EngineDevice()]
+            self.worker_devices = tuple(
+                self.devices[i % len(self.devices)] for i in range(worker_num)
+            )
+        self.worker_num = len(self.worker_devices)
+
+        if worker_threads is not None:
+            self.worker_threads = tuple(worker_threads)
+        else:
+            self.worker_threads = (None,) * self.worker_num
 
         self.init()
 
+    def device_threads(self, device: EngineDevice) -> Optional[ThreadAllocation]:
+        """Thread allocation of a model shared by the workers on `device`."""
+        allocations = [
+            threads
+            for dev, threads in zip(self.worker_devices, self.worker_threads)
+            if str(dev) == str(device) and threads is not None
+        ]
+        return ThreadAllocation.merge(allocations) if allocations else None
+
     def init(self):
         raise NotImplementedError()
 
@@ -44,7 +80,32 @@ class BaseWorkerManager:
         with self.lock:
             worker_index = self.worker_index
             self.worker_index = (self.worker_index + 1) % self.worker_num
-        return self.workers[worker_index]
+
+        if self.policy is SchedulePolicy.ROUND_ROBIN:
+            return self.workers[worker_index]
+
+        # Rotate the candidates so that ties are broken in round-robin order
+        candidates = self.workers[worker_index:] + self.workers[:worker_index]
+
+        if self.policy is SchedulePolicy.LEAST_OUTSTANDING:
+            return min(candidates, key=lambda w: w.outstanding())
+
+        if self.policy is SchedulePolicy.SHORTEST_EXPECTED:
+            return min(candidates, key=lambda w: (w.expected_work(), w.outstanding()))
+
+        if self.policy is SchedulePolicy.DEVICE_BALANCE:
+            # Balance load across devices first, then across the workers
+            # sharing the least loaded device
+            groups: Dict[str, List[BaseWorker]] = {}
+            for worker in candidates:
+                groups.setdefault(str(worker.device), []).append(worker)
+
+            group = min(
+                groups.values(), key=lambda ws: sum(w.outstanding() for w in ws)
+            )
+            return min(group, key=lambda w: w.outstanding())
+
+        raise RuntimeError(f"Invalid schedule policy: {self.policy}")
 
     def stop(self):
         for worker in self.workers:
@@ -55,6 +116,9 @@ class BaseWorkerManager:
 
         self.workers = None
 
+    def metrics(self) -> List[Dict[str, Any]]:
+        return [worker.metrics() for worker in self.workers]
+
     def isReady(self) -> bool:
         for worker in self.workers:
             if not worker.isReady():
@@ -1,11 +1,59 @@
 import logging
 import re
+from typing import Dict, List, Optional, Union
 
 import pytz
 import torch
 from loguru import logger
 from prettytable import PrettyTable
-from pydantic import BaseSettings, Field, validator
+from pydantic import BaseSettings, Field, root_validator, validator
+
+from server.util.types import (
+    CompileMode,
+    GraphOptimization,
+    Precision,
+    SchedulePolicy,
+    SRBackend,
+    SROutputFormat,
+    WorkerBackend,
+)
+
+
+def parse_devices(value: str) -> List[Union[int, str]]:
+    """Parse device ids such as "cpu", "0", "cuda:1" or "0-3,cpu"."""
+    raw = str(value).strip().lower().replace("cuda:", "").replace("gpu:", "")
+    if not raw:
+        raise ValueError(f"No engine device specified")
+
+    pat1 = re.compile("^[0-9]+$")
+    pat2 = re.compile("^[0-9]+-[0-9]+$")
+    pat3 = re.compile("^cpu$")
+
+    gpu_total = torch.cuda.device_count()
+    avail = [x for x in range(gpu_total)]
+    avail.append("cpu")
+
+    ans = set()
+    values = raw.split(",")
+    for v in values:
+        if pat1.match(v):
+            ans.add(int(v))
+        elif pat2.match(v):
+            t = [int(x) for x in v.split("-")]
+            for i in range(t[0], t[1] + 1):
+                ans.add(i)
+        elif pat3.match(v):
+            ans.add(v)
+        else:
+            raise ValueError(f"Invalid device id: {v}")
+
+    ret = []
+    for v in ans:
+        if v in avail:
+            ret.append(v)
+        else:
+            raise ValueError(f"Invalid device id: {v}")
+    return ret
 
 
 class LogSettings(BaseSettings):
@@ -30,45 +78,64 @@ class ServerSettings(BaseSettings):
 
     @validator("devices")
     def validate_devices(value: str):
-        raw = str(value).strip().lower().replace("cuda:", "").replace("gpu:", "")
-        if not raw:
-            raise ValueError(f"No engine device specified")
-
-        pat1 = re.compile("^[0-9]+$")
-        pat2 = re.compile("^[0-9]+-[0-9]+$")
-        pat3 = re.compile("^cpu$")
-
-        gpu_total = torch.cuda.device_count()
-        avail = [x for x in range(gpu_total)]
-        avail.append("cpu")
-
-        ans = set()
-        values = raw.split(",")
-        for v in values:
-            if pat1.match(v):
-                ans.add(int(v))
-            elif pat2.match(v):
-                t = [int(x) for x in v.split("-")]
-                for i in range(t[0], t[1] + 1):
-                    ans.add(i)
-            elif pat3.match(v):
-                ans.add(v)
-            else:
-                raise ValueError(f"Invalid device id: {v}")
-
-        ret = []
-        for v in ans:
-            if v in avail:
-                ret.append(v)
-            else:
-                raise ValueError(f"Invalid device id: {v}")
-        return ret
+        return parse_devices(value)
 
     worker_num: int = Field(default=1, env="SERVER_WORKER_NUM")
     worker_queue_size: int = Field(default=-1, env="SERVER_WORKER_QUEUE_SIZE")
 
+    # Workers on the same device share one model instance
+    worker_share_model: bool = Field(default=True, env="SERVER_WORKER_SHARE_MODEL")
+
+    # Run every worker in its own process, models are then never shared
+    worker_backend: WorkerBackend = Field(
+        default=WorkerBackend.THREAD, env="SERVER_WORKER_BACKEND"
+    )
+
+    @validator("worker_backend", pre=True)
+    def validate_worker_backend(value):
+        if isinstance(value, WorkerBackend):
+            return value
+
+        _value = str(value).strip().lower()
+        for backend in WorkerBackend:
+            if backend.value == _value:
+                return backend
+
+        raise ValueError(f"Invalid worker backend: {value}")
+
     worker_batch_size: int = Field(default=32, env="SERVER_WORKER_BATCH_SIZE")
 
+    # Max wait (ms) for coalescing image requests into one batch
+    worker_batch_timeout: int = Field(default=5, env="SERVER_WORKER_BATCH_TIMEOUT")
+
+    worker_schedule_policy: SchedulePolicy = Field(
+        default=SchedulePolicy.ROUND_ROBIN, env="SERVER_WORKER_SCHEDULE_POLICY"
+    )
+
+    @validator("worker_schedule_policy", pre=True)
+    def validate_worker_schedule_policy(value):
+        if isinstance(value, SchedulePolicy):
+            return value
+
+        _value = str(value).strip().lower().replace("-", "_")
+        for policy in SchedulePolicy:
+            if policy.value == _value:
+                return policy
+
+        raise ValueError(f"Invalid worker schedule policy: {value}")
+
+    # Split CPU cores between the workers of all engines instead of letting
+    # torch, onnxruntime and OpenCV each use every core in every worker
+    thread_budget: bool = Field(default=True, env="SERVER_THREAD_BUDGET")
+
+    # Cores available to the budget, defaults to what this process may use
+    thread_budget_cores: Optional[int] = Field(
+        default=None, env="SERVER_THREAD_BUDGET_CORES"
+    )
+
+    # Pin every worker (and the threads it creates) to its own CPUs
+    thread_pinning: bool = Field(default=False, env="SERVER_THREAD_PINNING")
+
     timezone: str = Field(default="UTC", env="SERVER_TIMEZONE")
 
     @validator("timezone")
@@ -82,9 +149,325 @@ class ServerSettings(BaseSettings):
         raise ValueError(f"Invalid server timezone: {value}")
 
 
+class PoolSettings(BaseSettings):
+    """Worker pool of one engine, unset values fall back to `ServerSettings`.
+
+    Variables are prefixed per engine, e.g. `SR_DEVICES=0` and
+    `DETECTION_WORKER_NUM=1:2,2:2` (workers per device).
+    """
+
+    devices: Optional[str] = None
+
+    # Total number of workers spread over `devices`, or per device counts
+    worker_num: Optional[str] = None
+
+    worker_queue_size: Optional[int] = None
+
+    @validator("devices")
+    def validate_devices(value: Optional[str]):
+        if value is None:
+            return None
+        return parse_devices(value)
+
+    @validator("worker_num")
+    def validate_worker_num(value: Optional[str]):
+        if value is None:
+            return None
+
+        raw = str(value).strip().lower()
+        if re.match("^[0-9]+$", raw):
+            if int(raw) <= 0:
+                raise ValueError(f"Invalid worker number: {value}")
+            return int(raw)
+
+        ret = {}
+        for v in raw.split(","):
+            device, _, num = v.strip().rpartition(":")
+            if not device or not num.isdigit():
+                raise ValueError(f"Invalid worker number: {v}")
+            for dev in parse_devices(device):
+                ret[dev] = int(num)
+        return ret
+
+    def workers(self, server: ServerSettings) -> List[Union[int, str]]:
+        """Device of every worker in the pool."""
+        devices = self.devices if self.devices is not None else server.devices
+        if not devices:
+            raise ValueError("No engine device specified")
+
+        worker_num = self.worker_num
+        if worker_num is None:
+            worker_num = server.worker_num
+
+        if isinstance(worker_num, dict):
+            unknown = [dev for dev in worker_num.keys() if dev not in devices]
+            if unknown:
+                raise ValueError(f"Workers configured for unused devices: {unknown}")
+            ret = [dev for dev in devices for _ in range(worker_num.get(dev, 0))]
+        else:
+            ret = [devices[i % len(devices)] for i in range(worker_num)]
+
+        if not ret:
+            raise ValueError("No worker configured")
+        return ret
+
+    def queue_size(self, server: ServerSettings) -> int:
+        if self.worker_queue_size is not None:
+            return self.worker_queue_size
+        return server.worker_queue_size
+
+
+class DetectionSettings(PoolSettings):
+    worker_batch_size: Optional[int] = None
+    worker_batch_timeout: Optional[int] = None
+
+    # Run through per-worker onnxruntime IO bindings with reused input buffers
+    io_binding: bool = Field(default=True, env="DETECTION_IO_BINDING")
+
+    # onnxruntime graph optimisation level (disable, basic, extended, all)
+    graph_optimization: GraphOptimization = Field(
+        default=GraphOptimization.ALL, env="DETECTION_GRAPH_OPTIMIZATION"
+    )
+
+    # Optimised graphs are cached here across workers and restarts ("": off)
+    onnx_cache_dir: str = Field(
+        default="~/.cache/polymer/onnx", env="DETECTION_ONNX_CACHE_DIR"
+    )
+
+    # Seconds a worker waits for a stream consumer that stopped reading
+    # before the stream is cancelled, so one stalled client cannot hold it
+    stream_stall_timeout: float = Field(
+        default=30.0, env="DETECTION_STREAM_STALL_TIMEOUT"
+    )
+
+    @validator("graph_optimization", pre=True)
+    def validate_graph_optimization(value):
+        if isinstance(value, GraphOptimization):
+            return value
+
+        _value = str(value).strip().lower()
+        for optimization in GraphOptimization:
+            if optimization.value == _value:
+                return optimization
+
+        raise ValueError(f"Invalid graph optimization: {value}")
+
+    @validator("stream_stall_timeout")
+    def validate_stream_stall_timeout(value: float):
+        if value <= 0:
+            raise ValueError(f"Invalid non-positive value: {value}")
+        return value
+
+    class Config:
+        env_prefix = "DETECTION_"
+
+    def batch_size(self, server: ServerSettings) -> int:
+        if self.worker_batch_size is not None:
+            return self.worker_batch_size
+        return server.worker_batch_size
+
+    def batch_timeout(self, server: ServerSettings) -> int:
+        if self.worker_batch_timeout is not None:
+            return self.worker_batch_timeout
+        return server.worker_batch_timeout
+
+
+class SRSettings(PoolSettings):
+    class Config:
+        env_prefix = "SR_"
+
+    # Inference runtime of the SR network
+    backend: SRBackend = Field(default=SRBackend.TORCH, env="SR_BACKEND")
+
+    # Exported graph used by the onnx backend, see `server.engine.SR.Export`
+    onnx_model_path: str = Field(
+        default="server/plugin/HAT/pretrained/HAT-L_SRx4_ImageNet-pretrain.onnx",
+        env="SR_ONNX_MODEL_PATH",
+    )
+
+    @validator("backend", pre=True)
+    def validate_backend(value):
+        if isinstance(value, SRBackend):
+            return value
+
+        _value = str(value).strip().lower()
+        for backend in SRBackend:
+            if backend.value == _value:
+                return backend
+
+        raise ValueError(f"Invalid SR backend: {value}")
+
+    # Inputs larger than this many pixels are processed tile by tile (0: never)
+    tile_threshold: int = Field(default=1024 * 1024, env="SR_TILE_THRESHOLD")
+
+    tile_size: int = Field(default=256, env="SR_TILE_SIZE")
+    tile_pad: int = Field(default=32, env="SR_TILE_PAD")
+
+    # Number of tiles stacked into a single forward pass
+    tile_batch_size: int = Field(default=4, env="SR_TILE_BATCH_SIZE")
+
+    # Blend overlapping tile borders linearly instead of cutting at the core
+    tile_feather: bool = Field(default=False, env="SR_TILE_FEATHER")
+
+    # Inference precision per device type, reduced precision runs under autocast
+    precision_cpu: Precision = Field(default=Precision.FP32, env="SR_PRECISION_CPU")
+    precision_gpu: Precision = Field(default=Precision.FP32, env="SR_PRECISION_GPU")
+
+    @validator("precision_cpu", "precision_gpu", pre=True)
+    def validate_precision(value):
+        if isinstance(value, Precision):
+            return value
+
+        _value = str(value).strip().lower()
+        for precision in Precision:
+            if precision.value == _value:
+                return precision
+
+        raise ValueError(f"Invalid precision: {value}")
+
+    @validator("precision_cpu")
+    def validate_precision_cpu(value: Precision):
+        if value is Precision.FP16:
+            raise ValueError("fp16 is not supported on CPU, use bf16 instead")
+        return value
+
+    # Optimised execution of the SR network, see `CompileMode`
+    compile_mode: CompileMode = Field(default=CompileMode.NONE, env="SR_COMPILE_MODE")
+
+    # `torch.compile` mode (default, reduce-overhead, max-autotune)
+    compile_backend_mode: str = Field(default="default", env="SR_COMPILE_BACKEND_MODE")
+
+    # Input sizes (e.g. "256x256,512x768") run once at startup, so that their
+    # compiled graphs and caches are ready before the first request
+    warmup_shapes: str = Field(default="", env="SR_WARMUP_SHAPES")
+
+    @validator("compile_mode", pre=True)
+    def validate_compile_mode(value):
+        if isinstance(value, CompileMode):
+            return value
+
+        _value = str(value).strip().lower()
+        for mode in CompileMode:
+            if mode.value == _value:
+                return mode
+
+        raise ValueError(f"Invalid compile mode: {value}")
+
+    @validator("compile_backend_mode")
+    def validate_compile_backend_mode(value: str):
+        _value = str(value).strip().lower()
+        if _value not in ("default", "reduce-overhead", "max-autotune"):
+            raise ValueError(f"Invalid compile backend mode: {value}")
+        return _value
+
+    @validator("warmup_shapes")
+    def validate_warmup_shapes(value: str):
+        pat = re.compile("^[0-9]+x[0-9]+$")
+
+        ret = []
+        for v in str(value or "").strip().lower().split(","):
+            v = v.strip()
+            if not v:
+                continue
+            if not pat.match(v):
+                raise ValueError(f"Invalid warmup shape: {v}")
+
+            h, w = [int(x) for x in v.split("x")]
+            if h <= 0 or w <= 0:
+                raise ValueError(f"Invalid warmup shape: {v}")
+            ret.append((h, w))
+        return ret
+
+    # Pad untiled inputs per side up to the smallest of these sizes (e.g.
+    # "256,512,768,1024"), so that varying resolutions share a few shapes
+    shape_buckets: str = Field(default="", env="SR_SHAPE_BUCKETS")
+
+    @validator("shape_buckets")
+    def validate_shape_buckets(value: str):
+        ret = set()
+        for v in str(value or "").strip().split(","):
+            v = v.strip()
+            if not v:
+                continue
+            if not v.isdigit() or int(v) <= 0:
+                raise ValueError(f"Invalid shape bucket: {v}")
+            ret.add(int(v))
+        return sorted(ret)
+
+    # Output format used when a request does not ask for one
+    output_format: SROutputFormat = Field(
+        default=SROutputFormat.PNG, env="SR_OUTPUT_FORMAT"
+    )
+
+    # PNG zlib level (0-9), lower is faster and larger
+    output_png_compression: int = Field(default=1, env="SR_OUTPUT_PNG_COMPRESSION")
+
+    # JPEG / lossy WebP quality (1-100)
+    output_quality: int = Field(default=95, env="SR_OUTPUT_QUALITY")
+
+    # Threads encoding results outside of the event loop
+    encode_workers: int = Field(default=2, env="SR_ENCODE_WORKERS")
+
+    @validator("output_format", pre=True)
+    def validate_output_format(value):
+        if isinstance(value, SROutputFormat):
+            return value
+
+        _value = str(value).strip().lower()
+        for output_format in SROutputFormat:
+            if output_format.value == _value:
+                return output_format
+
+        raise ValueError(f"Invalid SR output format: {value}")
+
+    @validator("output_png_compression")
+    def validate_output_png_compression(value: int):
+        if not 0 <= value <= 9:
+            raise ValueError(f"Invalid PNG compression level: {value}")
+        return value
+
+    @validator("output_quality")
+    def validate_output_quality(value: int):
+        if not 1 <= value <= 100:
+            raise ValueError(f"Invalid output quality: {value}")
+        return value
+
+    @validator("tile_threshold", "tile_pad")
+    def validate_non_negative(value: int):
+        if value < 0:
+            raise ValueError(f"Invalid negative value: {value}")
+        return value
+
+    @validator("tile_size", "tile_batch_size", "encode_workers")
+    def validate_positive(value: int):
+        if value <= 0:
+            raise ValueError(f"Invalid non-positive value: {value}")
+        return value
+
+
 class Settings(BaseSettings):
     log: LogSettings = LogSettings()
     server: ServerSettings = ServerSettings()
+    sr: SRSettings = SRSettings()
+    detection: DetectionSettings = DetectionSettings()
+
+    def worker_pools(self) -> Dict[str, List[Union[int, str]]]:
+        """Device of every worker, per engine."""
+        return {
+            "sr": self.sr.workers(self.server),
+            "detection": self.detection.workers(self.server),
+        }
+
+    @root_validator(skip_on_failure=True)
+    def validate_pools(cls, values):
+        server: ServerSettings = values.get("server")
+        for name in ("sr", "detection"):
+            pool: PoolSettings = values.get(name)
+            try:
+                pool.workers(server)
+            except ValueError as e:
+                raise ValueError(f"Invalid {name} worker pool: {e}")
+        return values
 
     @staticmethod
     def print(settings):
@@ -101,3 +484,17 @@ class Settings(BaseSettings):
         for key, value in dict(settings.server).items():
             table.add_row([key, value])
         logger.info("\n{}", table)
+
+        table = PrettyTable()
+        table.field_names = ["Detection Variable", "Value"]
+        table.align["Value"] = "l"
+        for key, value in dict(settings.detection).items():
+            table.add_row([key, value])
+        logger.info("\n{}", table)
+
+        table = PrettyTable()
+        table.field_names = ["SR Variable", "Value"]
+        table.align["Value"] = "l"
+        for key, value in dict(settings.sr).items():
+            table.add_row([key, value])
+        logger.info("\n{}", table)
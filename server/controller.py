@@ -1,14 +1,32 @@
+import json
+import os
+import shutil
 import tempfile
-from typing import List
+from queue import Full
+from typing import List, Optional
 
 from dependency_injector.wiring import Provide, inject
-from fastapi import APIRouter, Depends, HTTPException, Response, UploadFile
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from loguru import logger
+from pydantic import ValidationError
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile as StarletteUploadFile
 
 from server.application import Application
 from server.base.Engine import BaseEngine
 from server.base.Message import BaseMessage, BaseMessageType, BaseResult
 from server.engine.Container import EngineContainer
+from server.engine.detection.Engine import DetectionEngine
 from server.engine.detection.Message import (
     DetectionInputType,
     DetectionResult,
@@ -16,11 +34,27 @@ from server.engine.detection.Message import (
     FrameData,
 )
 from server.engine.SR.Message import SRTask
-from server.payload.actuator.Response import Health
+from server.payload.actuator.Response import Health, Metrics
 from server.payload.detection.Response import DetectionResponse
+from server.payload.SR.Encoder import SR_MEDIA_TYPES, SREncoder
 from server.payload.SR.Request import SRRequest
-from server.payload.SR.Response import SRResponse
-from server.util.types import ServerStatus
+from server.util.types import ServerStatus, SROutputFormat
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+SR_RAW_CONTENT_TYPE = "application/octet-stream"
+
+
+async def save_upload_file(file: UploadFile, path: str):
+    """Copy an upload to `path` in fixed-size chunks off the event loop."""
+
+    def _copy():
+        with open(path, mode="wb") as f:
+            shutil.copyfileobj(file.file, f, UPLOAD_CHUNK_SIZE)
+
+    await file.seek(0)
+    await run_in_threadpool(_copy)
+
 
 actuator = APIRouter(prefix="/actuator")
 
@@ -39,27 +73,106 @@ async def get_actuator_health(
     )
 
 
+@actuator.get("/metrics")
+@inject
+async def get_actuator_metrics(
+    engines: EngineContainer = Depends(Provide[Application.engine_container]),
+):
+    return Metrics(
+        super_resolution=engines.sr_engine().metrics(),
+        detection=engines.detection_engine().metrics(),
+    )
+
+
 api = APIRouter(prefix="/api")
 
 
+async def read_sr_task(request: Request) -> SRTask:
+    """Build an SR task from a JSON (base64), multipart or raw image body."""
+    content_type = request.headers.get("content-type", "")
+    content_type = content_type.split(";")[0].strip().lower()
+
+    if content_type == "multipart/form-data":
+        form = await request.form()
+        file = form.get("file")
+        if not isinstance(file, StarletteUploadFile):
+            raise HTTPException(status_code=422, detail="Missing `file` field")
+        image_data = await file.read()
+    elif content_type.startswith("image/") or content_type == SR_RAW_CONTENT_TYPE:
+        image_data = await request.body()
+    else:
+        try:
+            payload = SRRequest.parse_raw(await request.body())
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors())
+        return SRTask(image=payload.data)
+
+    if not image_data:
+        raise HTTPException(status_code=422, detail="Empty image")
+    return SRTask(image_data=image_data)
+
+
+SR_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "application/json": {"schema": SRRequest.schema()},
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {"file": {"type": "string", "format": "binary"}},
+                "required": ["file"],
+            }
+        },
+        "image/*": {"schema": {"type": "string", "format": "binary"}},
+        SR_RAW_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}},
+    },
+}
+
+
 @api.post(
     "/superresolution",
-    responses={200: {"content": {"image/png": {}}}},
+    responses={
+        200: {
+            "content": {media_type: {} for media_type in SR_MEDIA_TYPES.values()},
+            "headers": {
+                "X-Image-Shape": {
+                    "description": "`height,width,channels` of a raw RGB output",
+                    "schema": {"type": "string"},
+                }
+            },
+        }
+    },
     response_class=Response,
+    openapi_extra={"requestBody": SR_REQUEST_BODY},
 )
 @inject
 async def submit_sr(
-    request: SRRequest,
+    request: Request,
+    output_format: Optional[SROutputFormat] = Query(default=None, alias="format"),
+    quality: Optional[int] = Query(default=None, ge=1, le=100),
+    compression: Optional[int] = Query(default=None, ge=0, le=9),
+    lossless: bool = False,
     engine: BaseEngine = Depends(Provide[Application.engine_container().sr_engine]),
+    encoder: SREncoder = Depends(Provide[Application.sr_encoder]),
 ):
     if not engine.isReady():
         raise HTTPException(status_code=503, detail="Engine not ready")
-    task = SRTask(image=request.data)
-    result: BaseMessage = engine.process(task)
+    task = await read_sr_task(request)
+    try:
+        result: BaseMessage = await engine.submit(task)
+    except Full:
+        raise HTTPException(status_code=503, detail="Engine busy")
     if result.type == BaseMessageType.FAILED:
         raise HTTPException(status_code=500, detail=f"Failed to process task")
 
-    return SRResponse(result=result)
+    options = encoder.options(
+        format=output_format,
+        accept=request.headers.get("accept"),
+        quality=quality,
+        compression=compression,
+        lossless=lossless,
+    )
+    return await encoder.encode_async(result.data, options)
 
 
 @api.post("/detection/image")
@@ -76,12 +189,15 @@ async def submit_detection_image(
     image = await file.read()
     task = DetectionTask(input_type=DetectionInputType.IMAGE, image_data=[image])
 
-    result: DetectionResult = engine.process(task)
+    try:
+        result: DetectionResult = await engine.submit(task)
+    except Full:
+        raise HTTPException(status_code=503, detail="Engine busy")
     if result.type == BaseMessageType.FAILED or len(result.data) <= 0:
         raise HTTPException(status_code=500, detail=f"Failed to process task")
 
     data: FrameData = result.data[0]
-    return DetectionResponse(patches=data.patches)
+    return DetectionResponse.from_frame(data, frame_index=False)
 
 
 @api.post("/detection/images")
@@ -98,14 +214,14 @@ async def submit_detection_images(
     images = [await f.read() for f in file]
     task = DetectionTask(input_type=DetectionInputType.IMAGE, image_data=images)
 
-    result: DetectionResult = engine.process(task)
+    try:
+        result: DetectionResult = await engine.submit(task)
+    except Full:
+        raise HTTPException(status_code=503, detail="Engine busy")
     if result.type == BaseMessageType.FAILED or len(result.data) <= 0:
         raise HTTPException(status_code=500, detail=f"Failed to process task")
 
-    return [
-        DetectionResponse(frame_index=d.frame_index, patches=d.patches)
-        for d in result.data
-    ]
+    return [DetectionResponse.from_frame(d) for d in result.data]
 
 
 @api.post("/detection/video")
@@ -120,23 +236,102 @@ async def submit_detection_video(
         raise HTTPException(status_code=503, detail="Engine not ready")
 
     with tempfile.TemporaryDirectory() as tmpdir:
-        video_path = f"{tmpdir}/{file.filename}"
-        with open(video_path, mode="wb") as f:
-            f.write(await file.read())
+        video_path = f"{tmpdir}/{os.path.basename(file.filename or 'video')}"
+        await save_upload_file(file, video_path)
 
         task = DetectionTask(input_type=DetectionInputType.VIDEO, video_path=video_path)
-        result: DetectionResult = engine.process(task)
+        try:
+            result: DetectionResult = await engine.submit(task)
+        except Full:
+            raise HTTPException(status_code=503, detail="Engine busy")
         if result.type == BaseMessageType.FAILED or len(result.data) <= 0:
             raise HTTPException(status_code=500, detail=f"Failed to process task")
 
     response: List[DetectionResponse] = []
     for ret in result.data:
-        response.append(
-            DetectionResponse(frame_index=ret.frame_index, patches=ret.patches)
-        )
+        response.append(DetectionResponse.from_frame(ret))
     return response
 
 
+@api.post(
+    "/detection/video/stream",
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    response_class=StreamingResponse,
+)
+@inject
+async def submit_detection_video_stream(
+    file: UploadFile,
+    engine: DetectionEngine = Depends(
+        Provide[Application.engine_container().detection_engine]
+    ),
+):
+    """Stream one `DetectionResponse` JSON line per frame as batches complete.
+
+    A failure after streaming has started is reported as a final
+    `{"detail": ...}` line, since the status code has already been sent.
+    """
+    if not engine.isReady():
+        raise HTTPException(status_code=503, detail="Engine not ready")
+
+    tmpdir = tempfile.mkdtemp()
+    video_path = f"{tmpdir}/{os.path.basename(file.filename or 'video')}"
+    results = None
+
+    try:
+        await save_upload_file(file, video_path)
+
+        task = DetectionTask(input_type=DetectionInputType.VIDEO, video_path=video_path)
+        results = engine.stream(task)
+
+        # Wait for the first batch so that early failures keep their status code
+        first: DetectionResult = await results.__anext__()
+    except Full:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise HTTPException(status_code=503, detail="Engine busy")
+    except BaseException:
+        # Also on client disconnects (CancelledError): stop the worker too
+        if results is not None:
+            await results.aclose()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+
+    if first.type == BaseMessageType.FAILED:
+        await results.aclose()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=f"Failed to process task")
+
+    async def cleanup():
+        await results.aclose()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    async def generate():
+        try:
+            result = first
+            while True:
+                if result.type == BaseMessageType.FAILED:
+                    yield json.dumps({"detail": "Failed to process task"}) + "\n"
+                    break
+
+                yield "".join(
+                    DetectionResponse.from_frame(ret).json() + "\n"
+                    for ret in result.data
+                )
+
+                try:
+                    result = await results.__anext__()
+                except StopAsyncIteration:
+                    break
+        finally:
+            await cleanup()
+
+    # Also runs when the client is gone before `generate` ever started
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(cleanup),
+    )
+
+
 router = APIRouter()
 router.include_router(actuator)
 router.include_router(api)
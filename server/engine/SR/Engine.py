@@ -1,5 +1,6 @@
 """Engine impl module."""
-from typing import Union
+import asyncio
+from typing import Any, Dict, List, Union
 
 from server.base.Engine import BaseEngine
 from server.base.Message import BaseFailed
@@ -17,11 +18,17 @@ class SREngine(BaseEngine):
 
     def process(self, task: SRTask) -> Union[SRResult, BaseFailed]:
         worker = self.__worker_manager.next()
-        worker.push(task)
-        return worker.sink.get()
+        return worker.submit(task).result()
+
+    async def submit(self, task: SRTask) -> Union[SRResult, BaseFailed]:
+        worker = self.__worker_manager.next()
+        return await asyncio.wrap_future(worker.submit(task))
 
     def stop(self):
         self.__worker_manager.stop()
 
     def isReady(self) -> bool:
         return self.__worker_manager.isReady()
+
+    def metrics(self) -> List[Dict[str, Any]]:
+        return self.__worker_manager.metrics()
@@ -0,0 +1,60 @@
+"""Export the SR network to ONNX for the onnx backend.
+
+    $ python -m server.engine.SR.Export [output path]
+"""
+import inspect
+import sys
+
+import torch
+from loguru import logger
+
+from server.config.Settings import SRSettings
+from server.engine.SR.Model import SRModel
+from server.util.types import CompileMode, EngineDevice, Precision, SRBackend
+
+ONNX_OPSET_VERSION = 17
+
+# Recent torch (>= 2.5) can also export through dynamo, the default from 2.9;
+# these graphs go through the TorchScript exporter, the only one of older torch
+TORCHSCRIPT_EXPORT_OPTIONS = (
+    {"dynamo": False}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters
+    else {}
+)
+
+
+def export_onnx(
+    network: torch.nn.Module, path: str, opset_version: int = ONNX_OPSET_VERSION
+):
+    """Export `network` with dynamic batch, height and width."""
+    network.eval()
+
+    # Any window aligned size works, the graph is not specialised on it
+    example = torch.rand(1, 3, 64, 64, device=next(network.parameters()).device)
+    dynamic_axes = {0: "batch", 2: "height", 3: "width"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            network,
+            (example,),
+            path,
+            input_names=["input"],
+            output_names=["output"],
+            dynamic_axes={"input": dynamic_axes, "output": dynamic_axes},
+            opset_version=opset_version,
+            **TORCHSCRIPT_EXPORT_OPTIONS,
+        )
+
+
+if __name__ == "__main__":
+    # Plain fp32 torch network, whatever the deployment settings are
+    setting = SRSettings(
+        backend=SRBackend.TORCH,
+        precision_cpu=Precision.FP32,
+        compile_mode=CompileMode.NONE,
+    )
+    path = sys.argv[1] if len(sys.argv) > 1 else setting.onnx_model_path
+
+    model = SRModel(device=EngineDevice(), setting=setting)
+    export_onnx(model.get_bare_model(model.net_g), path)
+    logger.info(f"Exported SR network to {path}")
@@ -1,12 +1,15 @@
 """Parser impl module."""
+from typing import Optional
+
 import numpy as np
 
 from server.base.Message import BaseResult, BaseTask
 
 
 class SRTask(BaseTask):
-    image: str
+    image: Optional[str]  # Base64 encoded
+    image_data: Optional[bytes]  # Raw encoded image, preferred over `image`
 
 
 class SRResult(BaseResult):
-    data: np.ndarray
+    data: np.ndarray  # HWC, BGR, uint8
@@ -1,10 +1,27 @@
+import contextlib
+import math
 import sys
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
 
+import numpy as np
+import onnxruntime
 import torch
 import yaml
 from basicsr.utils.options import ordered_yaml
+from loguru import logger
 
-from server.util.types import EngineDevice
+from server.base.ThreadBudget import ThreadAllocation
+from server.config.Settings import SRSettings
+from server.util.cpuinfo import get_cpu_info
+from server.util.onnx import create_session, get_ort_device
+from server.util.types import (
+    CompileMode,
+    DeviceType,
+    EngineDevice,
+    Precision,
+    SRBackend,
+)
 
 sys.path.insert(0, "server/plugin/HAT")
 
@@ -13,23 +30,370 @@ from server.plugin.HAT.hat.models.hat_model import HATModel
 MODEL_DEFINITION = "server/plugin/HAT/resource/HAT-L_SRx4_ImageNet-pretrain.yml"
 
 
+def resolve_precision(device: EngineDevice, setting: SRSettings) -> Precision:
+    """Pick the configured precision for `device`, falling back if unsupported."""
+    if device.mode is DeviceType.GPU:
+        precision = setting.precision_gpu
+        if precision is Precision.BF16 and not torch.cuda.is_bf16_supported():
+            logger.warning(f"[{device}] bf16 is not supported, using fp16 instead")
+            precision = Precision.FP16
+        return precision
+
+    precision = setting.precision_cpu
+    if precision is Precision.BF16:
+        flags = get_cpu_info().get("flags", [])
+        if "avx512_bf16" not in flags and "amx_bf16" not in flags:
+            logger.warning(f"[{device}] No native bf16 support, inference may be slow")
+    return precision
+
+
+def cast_network(net: torch.nn.Module, precision: Precision) -> torch.nn.Module:
+    """Cast weights once at load time so autocast does not re-cast every call."""
+    if precision is Precision.FP32:
+        return net
+    return net.to(dtype=precision.torch())
+
+
+def autocast(device: EngineDevice, precision: Precision):
+    if precision is Precision.FP32:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.mode.value, dtype=precision.torch())
+
+
+class TracedNetwork(torch.nn.Module):
+    """TorchScript traces of a network for a fixed set of input shapes.
+
+    Inputs matching a traced shape run the trace, any other shape runs the
+    network eagerly.
+    """
+
+    network: torch.nn.Module
+    traces: Dict[Tuple[int, ...], torch.jit.ScriptModule]
+
+    def __init__(self, network: torch.nn.Module):
+        super().__init__()
+        self.network = network
+        self.traces = {}
+
+    def trace(self, input: torch.Tensor):
+        shape = tuple(input.shape)
+        if shape not in self.traces:
+            with torch.no_grad():
+                self.traces[shape] = torch.jit.trace(
+                    self.network, input, check_trace=False
+                )
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        trace = self.traces.get(tuple(input.shape))
+        if trace is None:
+            return self.network(input)
+        return trace(input)
+
+
+class CompiledNetwork(torch.nn.Module):
+    """`torch.compile` of a network, used only for the shapes compiled at warmup.
+
+    Any other shape runs the network eagerly instead of recompiling on the
+    request path.
+    """
+
+    network: torch.nn.Module
+    compiled: torch.nn.Module
+    shapes: Set[Tuple[int, ...]]
+
+    def __init__(self, network: torch.nn.Module, mode: str = "default"):
+        super().__init__()
+        self.network = network
+        self.compiled = torch.compile(network, mode=mode, dynamic=False)
+        self.shapes = set()
+
+    def compile(self, input: torch.Tensor):
+        shape = tuple(input.shape)
+        if shape not in self.shapes:
+            # Every warmed shape keeps its own graph
+            config = torch._dynamo.config
+            name = (
+                "recompile_limit"
+                if hasattr(config, "recompile_limit")
+                else "cache_size_limit"
+            )
+            setattr(config, name, max(getattr(config, name), len(self.shapes) + 1))
+
+            with torch.no_grad():
+                self.compiled(input)
+            self.shapes.add(shape)
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        if tuple(input.shape) not in self.shapes:
+            return self.network(input)
+        return self.compiled(input)
+
+
+def tile_windows(
+    tile_size: int, tile_pad: int, window_size: int, tile_threshold: int
+) -> List[Tuple[int, int]]:
+    """(height, width) of every tile window `tile_process` can run.
+
+    Windows are clamped to the image, padded to a multiple of `window_size`,
+    so images narrower than a window in one side run narrower windows.
+    """
+    window = tile_size + 2 * tile_pad
+    sizes = range(window_size, window + 1, window_size)
+    return [
+        (h, w)
+        for h in sizes
+        for w in sizes
+        if h == window or w == window or h * w > tile_threshold
+    ]
+
+
+class OnnxNetwork(torch.nn.Module):
+    """An exported SR graph run by onnxruntime, in place of the torch network.
+
+    Input and output are bound to the memory of torch tensors on the model
+    device, so tiles never leave the GPU. The output is preallocated from the
+    input shape and the upscale factor `scale`.
+    """
+
+    __session: onnxruntime.InferenceSession
+    __input_name: str
+    __output_name: str
+    __device: EngineDevice
+    __scale: int
+
+    def __init__(
+        self,
+        path: str,
+        device: EngineDevice,
+        scale: int,
+        threads: ThreadAllocation = None,
+    ):
+        super().__init__()
+        self.__session = create_session(path, device, threads=threads)
+        self.__input_name = self.__session.get_inputs()[0].name
+        self.__output_name = self.__session.get_outputs()[0].name
+        self.__device = device
+        self.__scale = scale
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        device_type, device_id = get_ort_device(self.__device)
+        input = input.detach().to(self.__device.torch(), torch.float32).contiguous()
+        n, c, h, w = input.shape
+        output = torch.empty(
+            (n, c, h * self.__scale, w * self.__scale),
+            dtype=torch.float32,
+            device=input.device,
+        )
+
+        binding = self.__session.io_binding()
+        for name, tensor in [(self.__input_name, input), (self.__output_name, output)]:
+            bind = binding.bind_input if tensor is input else binding.bind_output
+            bind(
+                name,
+                device_type=device_type,
+                device_id=device_id,
+                element_type=np.float32,
+                shape=tuple(tensor.shape),
+                buffer_ptr=tensor.data_ptr(),
+            )
+
+        if self.__device.mode is DeviceType.GPU:
+            # onnxruntime runs on its own stream, the input must be ready
+            torch.cuda.current_stream(input.device).synchronize()
+        self.__session.run_with_iobinding(binding)
+        binding.synchronize_outputs()
+        return output
+
+
 class SRModel(HATModel):
     __device: EngineDevice
+    __backend: SRBackend
+    __precision: Precision
+    __tile_threshold: int
+
+    __network: torch.nn.Module  # Eager network, whatever wraps `net_g`
+    __warmup_shapes: List[Tuple[int, ...]]
+    __stream: Optional[torch.cuda.Stream]
 
-    def __init__(self, device: EngineDevice):
+    def __init__(
+        self,
+        device: EngineDevice,
+        setting: SRSettings = None,
+        shared: "SRModel" = None,
+        threads: ThreadAllocation = None,
+    ):
+        """With `shared`, reuse its (already warmed up) network instead of
+        loading another copy. Per-call state such as the input, padding and
+        output stays per instance, so every worker needs its own `SRModel`.
+        `threads` sizes the onnxruntime session of the onnx backend.
+        """
         self.__device = device
 
+        # Workers sharing the network on one GPU run on their own streams
+        self.__stream = None
+        if device.mode is DeviceType.GPU:
+            self.__stream = torch.cuda.Stream(device=device.torch())
+
+        if setting is None:
+            setting = SRSettings()
+
         with open(MODEL_DEFINITION, mode="r") as f:
             options = yaml.load(f, Loader=ordered_yaml()[0])
 
         options["is_train"] = False
         options["dist"] = False
 
-        super().__init__(options, device=str(device))
+        # Tile boundaries must stay aligned to the attention window
+        window_size = options["network_g"]["window_size"]
+        options["tile"] = {
+            "tile_size": math.ceil(setting.tile_size / window_size) * window_size,
+            "tile_pad": math.ceil(setting.tile_pad / window_size) * window_size,
+            "batch_size": setting.tile_batch_size,
+            "feather": setting.tile_feather,
+        }
+        self.__tile_threshold = setting.tile_threshold
+
+        # Buckets stay aligned to the attention window as well
+        buckets = sorted(
+            {math.ceil(b / window_size) * window_size for b in setting.shape_buckets}
+        )
+        options["buckets"] = buckets
+
+        # Keep one attention mask per bucket pair and tile shape
+        network_options = options["network_g"]
+        network_options["mask_cache_size"] = max(
+            network_options.get("mask_cache_size", 8), len(buckets) ** 2 + 1
+        )
+
+        if shared is not None:
+            super().__init__(options, device=str(device), net_g=shared.net_g)
+            self.__backend = shared.__backend
+            self.__precision = shared.__precision
+            self.__network = shared.__network
+            self.__warmup_shapes = []
+            return
+
+        self.__backend = setting.backend
+        if self.__backend is SRBackend.ONNX:
+            network = OnnxNetwork(
+                path=setting.onnx_model_path,
+                device=device,
+                scale=options["scale"],
+                threads=threads,
+            )
+            super().__init__(options, device=str(device), net_g=network)
+
+            # Precision and graph optimisation are fixed by the exported graph
+            self.__precision = Precision.FP32
+        else:
+            super().__init__(options, device=str(device))
+
+            self.__precision = resolve_precision(device, setting)
+            self.net_g = cast_network(self.net_g, self.__precision)
+        self.__network = self.get_bare_model(self.net_g)
+
+        # Network input shapes are padded to a multiple of the window size
+        self.__warmup_shapes = [
+            (
+                1,
+                3,
+                math.ceil(h / window_size) * window_size,
+                math.ceil(w / window_size) * window_size,
+            )
+            for h, w in setting.warmup_shapes
+        ]
+
+        compiled = (
+            self.__backend is SRBackend.TORCH
+            and setting.compile_mode is not CompileMode.NONE
+        )
+        if compiled or self.__backend is SRBackend.ONNX:
+            # Every untiled bucket pair is a fixed shape
+            self.__warmup_shapes.extend(
+                (1, 3, h, w)
+                for h in buckets
+                for w in buckets
+                if not 0 < self.__tile_threshold < h * w
+            )
+
+            # Every partial and full tile batch has a fixed shape. onnxruntime
+            # runs any shape without recompiling, the full window is enough
+            if self.__tile_threshold > 0:
+                tile = options["tile"]
+                windows = tile_windows(
+                    tile["tile_size"],
+                    tile["tile_pad"],
+                    window_size,
+                    self.__tile_threshold,
+                )
+                if not compiled:
+                    windows = windows[-1:]
+                self.__warmup_shapes.extend(
+                    (n, 3, h, w)
+                    for h, w in windows
+                    for n in range(1, tile["batch_size"] + 1)
+                )
+
+        if compiled and setting.compile_mode is CompileMode.TRACE:
+            self.net_g = TracedNetwork(self.net_g)
+        elif compiled:
+            self.net_g = CompiledNetwork(self.net_g, mode=setting.compile_backend_mode)
+
+    def warmup(self):
+        """Run every warmup shape once to trace / compile and fill caches."""
+        for shape in self.__warmup_shapes:
+            ts_start = time.perf_counter()
+
+            input = torch.zeros(shape, device=self.__device.torch())
+            with torch.no_grad(), autocast(self.__device, self.__precision):
+                if isinstance(self.net_g, TracedNetwork):
+                    self.net_g.trace(input)
+                elif isinstance(self.net_g, CompiledNetwork):
+                    self.net_g.compile(input)
+                self.net_g(input)
+
+            elapsed = time.perf_counter() - ts_start
+            logger.info(f"[{self.__device}] Warmup {shape}: {elapsed:.3f} seconds")
+
+    @property
+    def backend(self) -> SRBackend:
+        return self.__backend
+
+    @property
+    def precision(self) -> Precision:
+        return self.__precision
+
+    def cache_info(self) -> Dict[str, Any]:
+        if isinstance(self.__network, OnnxNetwork):
+            return {}
+        return self.__network.mask_cache_info()
 
     def __call__(self, input: torch.Tensor) -> torch.Tensor:
+        if self.__stream is None:
+            return self.__run(input)
+
+        current = torch.cuda.current_stream(self.__device.torch())
+        self.__stream.wait_stream(current)
+        with torch.cuda.stream(self.__stream):
+            output = self.__run(input)
+        current.wait_stream(self.__stream)
+        output.record_stream(current)
+        return output
+
+    def __run(self, input: torch.Tensor) -> torch.Tensor:
+        # Inputs and stitched outputs stay fp32, only the network runs reduced
         self.lq = input.to(self.__device.torch())
-        self.pre_process()
-        self.process()
+
+        # Tiles already have a fixed shape, only whole images are bucketed
+        _, _, h, w = self.lq.size()
+        tile = 0 < self.__tile_threshold < self._bucket_size(h) * self._bucket_size(w)
+        self.pre_process(bucket=not tile)
+
+        with autocast(self.__device, self.__precision):
+            if tile:
+                self.tile_process()
+            else:
+                self.process()
+
         self.post_process()
-        return self.output
+        return self.output.float()
@@ -0,0 +1,69 @@
+from io import BytesIO
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from server.util.types import DeviceType, EngineDevice
+
+
+class SRProcessor:
+    """Image conversion around the SR model.
+
+    Images stay uint8 (HWC, BGR) on the host. Channel reordering,
+    normalisation, clamping and quantisation all run on the model device, and
+    host to device copies go through a reusable pinned buffer on GPUs.
+    """
+
+    __device: EngineDevice
+    __pinned: torch.Tensor
+
+    def __init__(self, device: EngineDevice):
+        self.__device = device
+        self.__pinned = None
+
+    @staticmethod
+    def decode(data: bytes) -> np.ndarray:
+        """Decode an encoded image into a writable HWC BGR uint8 array."""
+        # EXIF orientation is ignored, as with the PIL decoder this replaced
+        image = cv2.imdecode(
+            np.frombuffer(data, dtype=np.uint8),
+            cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION,
+        )
+        if image is not None:
+            return image
+
+        # Fallback for formats OpenCV cannot decode (e.g. GIF)
+        image = np.asarray(Image.open(BytesIO(data)).convert("RGB"))
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+    def __stage(self, image: torch.Tensor) -> torch.Tensor:
+        # Reuse (and grow) one page-locked buffer for asynchronous uploads
+        size = image.numel()
+        if self.__pinned is None or self.__pinned.numel() < size:
+            self.__pinned = torch.empty(size, dtype=torch.uint8, pin_memory=True)
+
+        staged = self.__pinned[:size].view(image.shape)
+        staged.copy_(image)
+        return staged
+
+    def pre_process(self, image: np.ndarray) -> torch.Tensor:
+        """HWC BGR uint8 host array -> 1CHW RGB float tensor in [0, 1] on device."""
+        tensor = torch.from_numpy(image)
+
+        if self.__device.mode is DeviceType.GPU:
+            tensor = self.__stage(tensor)
+        tensor = tensor.to(self.__device.torch(), non_blocking=True)
+
+        tensor = tensor.permute(2, 0, 1).flip(0).unsqueeze(0)  # 1CHW, RGB
+        tensor = tensor.to(dtype=torch.float32, memory_format=torch.contiguous_format)
+        return tensor.div_(255.0)
+
+    @staticmethod
+    def post_process(output: torch.Tensor) -> np.ndarray:
+        """1CHW RGB float tensor in [0, 1] on device -> HWC BGR uint8 host array."""
+        output = output.detach().squeeze(0)
+        output = output.clamp_(0.0, 1.0).mul_(255.0).round_().to(torch.uint8)
+        output = output.flip(0).permute(1, 2, 0).contiguous()  # HWC, BGR
+        return output.cpu().numpy()
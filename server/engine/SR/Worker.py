@@ -1,65 +1,95 @@
 """Worker impl module."""
 import base64
-from io import BytesIO
+from typing import Any, Dict, Optional
 
-import numpy as np
-import torch
 from loguru import logger
-from PIL import Image
 
 from server.base.Message import BaseFailed
+from server.base.ModelRegistry import ModelRegistry
+from server.base.ThreadBudget import ThreadAllocation
 from server.base.Worker import BaseWorker
+from server.config.Settings import SRSettings
 from server.engine.SR.Message import SRResult, SRTask
 from server.engine.SR.Model import SRModel
+from server.engine.SR.Processor import SRProcessor
 from server.util.types import EngineDevice
 from server.util.util import create_timestamp
 
 
 class SRWorker(BaseWorker):
     model: SRModel
+    processor: SRProcessor
+
+    setting: SRSettings
+    models: Optional[ModelRegistry[SRModel]]
 
     def __init__(
         self,
         device: EngineDevice = None,
         queue_size: int = 100,
+        setting: SRSettings = None,
+        models: ModelRegistry[SRModel] = None,
+        threads: ThreadAllocation = None,
     ):
         if device is None:
             device = EngineDevice()
 
-        super().__init__(queue_size=queue_size, device=device)
+        self.setting = setting
+        self.models = models
+
+        super().__init__(queue_size=queue_size, device=device, threads=threads)
 
     def init(self):
-        self.model = SRModel(device=self.device)
+        if self.models is not None:
+            shared = self.models.acquire(self.device)
+            self.model = SRModel(
+                device=self.device, setting=self.setting, shared=shared
+            )
+        else:
+            self.model = SRModel(
+                device=self.device, setting=self.setting, threads=self.threads
+            )
+            self.model.warmup()
+        self.processor = SRProcessor(device=self.device)
+
+    def release(self):
+        if self.models is not None and hasattr(self, "model"):
+            self.models.release(self.device)
+
+    def metrics(self) -> Dict[str, Any]:
+        metrics = super().metrics()
+        if self.isReady() and hasattr(self, "model"):
+            metrics["backend"] = self.model.backend.value
+            metrics["precision"] = self.model.precision.value
+            metrics["attention_mask_cache"] = self.model.cache_info()
+        return metrics
 
     def process(self, msg: SRTask):
         ts_start = create_timestamp()
 
         task_id = msg.id
-        image_base64 = msg.image
+        if msg.image_data is not None:
+            imgdata = msg.image_data
+        elif msg.image is not None:
+            imgdata = base64.b64decode(msg.image)
+        else:
+            raise RuntimeError("No image data")
         del msg
 
         logger.info(f"Task `{str(task_id)}` started")
 
-        imgdata = base64.b64decode(image_base64)
-        img_ndarray = np.asarray(Image.open(BytesIO(imgdata)).convert("RGB"))  # HWC
-
-        img_tensor = img_ndarray / 255.0
-        img_tensor = torch.from_numpy(img_tensor).float()
-        img_tensor = img_tensor.permute(2, 0, 1).unsqueeze(0)  # 1CHW
-
-        output = self.model(img_tensor)
-
-        img_output: np.ndarray = (
-            output.detach().cpu().squeeze().permute(1, 2, 0).numpy() * 255.0
-        )
+        img_ndarray = self.processor.decode(imgdata)  # HWC, BGR
+        del imgdata
 
-        img_output = np.array(img_output)
+        output = self.model(self.processor.pre_process(img_ndarray))
+        img_output = self.processor.post_process(output)
+        del output
 
         result = SRResult(task_id=task_id, data=img_output)
 
         ts_end = create_timestamp()
 
-        self.sink.put(result)
+        self.emit(result)
 
         elapsed = (ts_end - ts_start) / 1000.0
 
@@ -71,5 +101,5 @@ class SRWorker(BaseWorker):
         try:
             self.process(msg)
         except Exception as e:
-            self.sink.put(BaseFailed(task_id=msg.id))
+            self.emit(BaseFailed(task_id=msg.id))
             raise RuntimeError(f"Failed to process task `{msg.id}`: {e}")
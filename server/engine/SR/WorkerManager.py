@@ -1,32 +1,77 @@
 """WorkerManager impl module."""
-from typing import List
+import contextlib
+from typing import List, Optional
 
+from server.base.ModelRegistry import ModelRegistry
+from server.base.ProcessWorker import ProcessWorker
+from server.base.ThreadBudget import ThreadBudget
 from server.base.Worker import BaseWorker
 from server.base.WorkerManager import BaseWorkerManager
-from server.config.Settings import Settings
+from server.config.Settings import Settings, SRSettings
+from server.engine.SR.Model import SRModel
 from server.engine.SR.Worker import SRWorker
-from server.util.types import EngineDevice
+from server.util.types import EngineDevice, WorkerBackend
 
 
 class SRWorkerManager(BaseWorkerManager):
+    __setting: SRSettings
+    __backend: WorkerBackend
+    __models: Optional[ModelRegistry[SRModel]]
+
     def __init__(
         self,
         setting: Settings,
     ):
-        worker_num = setting.server.worker_num
-        worker_queue_size = setting.server.worker_queue_size
-        devices = [EngineDevice(dev) for dev in setting.server.devices]
+        self.__setting = setting.sr
+        self.__backend = setting.server.worker_backend
+        self.__models = None
+        if setting.server.worker_share_model and self.__backend is WorkerBackend.THREAD:
+            self.__models = ModelRegistry(factory=self.__load_model)
+
+        # One device instance per id, shared by the workers on it
+        workers = self.__setting.workers(setting.server)
+        devices = {dev: EngineDevice(dev) for dev in set(workers)}
+        threads = None
+        if setting.server.thread_budget:
+            budget = ThreadBudget(
+                cores=setting.server.thread_budget_cores,
+                pin=setting.server.thread_pinning,
+            )
+            threads = budget.allocate(setting.worker_pools())["sr"]
+
         super().__init__(
-            worker_num=worker_num, devices=devices, queue_size=worker_queue_size
+            worker_devices=[devices[dev] for dev in workers],
+            worker_threads=threads,
+            queue_size=self.__setting.queue_size(setting.server),
+            policy=setting.server.worker_schedule_policy,
         )
 
+    def __load_model(self, device: EngineDevice) -> SRModel:
+        threads = self.device_threads(device)
+        with threads.pinned() if threads is not None else contextlib.nullcontext():
+            model = SRModel(device=device, setting=self.__setting, threads=threads)
+        model.warmup()
+        return model
+
     def init(self):
-        device_num = len(self.devices)
         workers: List[BaseWorker] = []
-        for i in range(self.worker_num):
-            worker = SRWorker(
-                device=self.devices[i % device_num], queue_size=self.worker_queue_size
-            )
+        for device, threads in zip(self.worker_devices, self.worker_threads):
+            if self.__backend is WorkerBackend.PROCESS:
+                worker = ProcessWorker(
+                    SRWorker,
+                    device=device,
+                    queue_size=self.worker_queue_size,
+                    setting=self.__setting,
+                    threads=threads,
+                )
+            else:
+                worker = SRWorker(
+                    device=device,
+                    queue_size=self.worker_queue_size,
+                    setting=self.__setting,
+                    models=self.__models,
+                    threads=threads,
+                )
             worker.start()
             workers.append(worker)
 
@@ -0,0 +1,49 @@
+"""Compare `InferenceSession.run` against IO binding for the detection model.
+
+    python -m server.engine.detection.Benchmark [model] [batch_size] [iterations]
+"""
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+
+from server.engine.detection.Model import DetectionModel
+from server.engine.detection.Processor import DetectionProcessor
+from server.plugin.yolov7 import MODEL_PATH
+from server.util.types import EngineDevice
+
+
+def benchmark(
+    model: DetectionModel, frames: List[np.ndarray], iterations: int = 20
+) -> Dict[str, float]:
+    """Mean milliseconds per batch of `frames` for both execution paths."""
+    processor = DetectionProcessor()
+    paths = {"run": None, "io_binding": model.io_binding()}
+
+    results: Dict[str, float] = {}
+    for name, binding in paths.items():
+        model(frames, processor=processor, binding=binding)  # Warmup
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(frames, processor=processor, binding=binding)
+        results[name] = (time.perf_counter() - start) * 1000 / iterations
+    return results
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else MODEL_PATH
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    rng = np.random.default_rng(0)
+    frames = [
+        rng.integers(0, 256, size=(720, 1280, 3), dtype=np.uint8)
+        for _ in range(batch_size)
+    ]
+    model = DetectionModel(device=EngineDevice(), path=path)
+
+    for name, ms in benchmark(model, frames, iterations).items():
+        logger.info(f"{name}: {ms:.2f} ms per batch of {batch_size}")
@@ -1,29 +1,108 @@
 """Engine impl module."""
-from typing import Union
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Union
 
 from loguru import logger
 
 from server.base.Engine import BaseEngine
 from server.base.Message import BaseFailed
 from server.base.WorkerManager import BaseWorkerManager
-from server.config.Settings import Settings
+from server.config.Settings import DetectionSettings, Settings
 from server.engine.detection.Message import DetectionResult, DetectionTask
 
+# Partial results buffered ahead of a slow streaming consumer
+STREAM_PREFETCH = 2
+
 
 class DetectionEngine(BaseEngine):
 
     __worker_manager: BaseWorkerManager
+    __stall_timeout: float
 
     def __init__(self, setting: Settings, worker_manager: BaseWorkerManager):
         self.__worker_manager = worker_manager
+        detection = setting.detection if setting is not None else DetectionSettings()
+        self.__stall_timeout = detection.stream_stall_timeout
 
     def process(self, task: DetectionTask) -> Union[DetectionResult, BaseFailed]:
         worker = self.__worker_manager.next()
-        worker.push(task)
-        return worker.sink.get()
+        return worker.submit(task).result()
+
+    async def submit(self, task: DetectionTask) -> Union[DetectionResult, BaseFailed]:
+        worker = self.__worker_manager.next()
+        return await asyncio.wrap_future(worker.submit(task))
+
+    async def stream(
+        self, task: DetectionTask
+    ) -> AsyncIterator[Union[DetectionResult, BaseFailed]]:
+        """Yield partial results of a streaming task, then its final result.
+
+        The worker blocks once `STREAM_PREFETCH` partial results are waiting,
+        and stops processing when the consumer goes away. A consumer that
+        stops reading for `stream_stall_timeout` seconds gets a failed final
+        result instead of the rest of the stream.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        credits = threading.Semaphore(STREAM_PREFETCH)
+        stall_timeout = self.__stall_timeout
+        closed = threading.Event()
+        stalled = threading.Event()
+
+        def listener(msg: DetectionResult) -> bool:
+            deadline = time.monotonic() + stall_timeout
+            while not closed.is_set():
+                if credits.acquire(timeout=0.1):
+                    loop.call_soon_threadsafe(queue.put_nowait, msg)
+                    return True
+                if time.monotonic() > deadline:
+                    logger.warning(
+                        f"[{__class__.__name__}] Stream of task `{msg.task_id}` stalled"
+                    )
+                    stalled.set()
+                    return False
+            return False
+
+        task.stream = True
+        worker = self.__worker_manager.next()
+        future = asyncio.wrap_future(worker.submit(task, listener=listener))
+        getter = None
+
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait(
+                    {getter, future}, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if getter.done():
+                    credits.release()
+                    yield getter.result()
+                    continue
+
+                while not queue.empty():
+                    credits.release()
+                    yield queue.get_nowait()
+
+                if stalled.is_set():
+                    yield BaseFailed(task_id=task.id)
+                else:
+                    yield future.result()
+                break
+        finally:
+            closed.set()
+            if getter is not None and not getter.done():
+                getter.cancel()
+            if not future.done():
+                future.cancel()
 
     def stop(self):
         self.__worker_manager.stop()
 
     def isReady(self) -> bool:
         return self.__worker_manager.isReady()
+
+    def metrics(self) -> List[Dict[str, Any]]:
+        return self.__worker_manager.metrics()
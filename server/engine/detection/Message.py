@@ -3,6 +3,7 @@ from enum import IntEnum, auto
 from typing import List, Optional
 
 import numpy as np
+from attrs import define, field
 from pydantic import BaseModel
 
 from server.base.Message import BaseResult, BaseTask
@@ -17,6 +18,7 @@ class DetectionTask(BaseTask):
     input_type: DetectionInputType
     image_data: Optional[List[bytes]]
     video_path: Optional[str]
+    stream: bool = False  # Publish per-batch partial results while processing
 
 
 class Box(BaseModel):
@@ -33,9 +35,35 @@ class PatchData(BaseModel):
     class_name: Optional[str]
 
 
-class FrameData(BaseModel):
+@define(eq=False)
+class FrameData:
+    """Detections of one frame, kept as arrays until they are serialized."""
+
     frame_index: Optional[int]
-    patches: List[PatchData]
+    boxes: np.ndarray = field(factory=lambda: np.zeros((0, 4), dtype=np.int32))
+    class_ids: np.ndarray = field(factory=lambda: np.zeros(0, dtype=np.int64))
+    scores: np.ndarray = field(factory=lambda: np.zeros(0, dtype=np.float64))
+    class_names: np.ndarray = field(factory=lambda: np.zeros(0, dtype=object))
+
+    def __len__(self) -> int:
+        return len(self.class_ids)
+
+    @property
+    def patches(self) -> List[PatchData]:
+        return [
+            PatchData(
+                box=Box(x1=x1, y1=y1, x2=x2, y2=y2),
+                class_id=class_id,
+                score=score,
+                class_name=class_name,
+            )
+            for (x1, y1, x2, y2), class_id, score, class_name in zip(
+                self.boxes.tolist(),
+                self.class_ids.tolist(),
+                self.scores.tolist(),
+                self.class_names.tolist(),
+            )
+        ]
 
 
 class DetectionResult(BaseResult):
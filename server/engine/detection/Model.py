@@ -1,12 +1,131 @@
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 import numpy as np
 import onnxruntime
 from loguru import logger
 
-from server.plugin.yolov7 import CLASS_NAMES, MODEL_PATH, letterbox
+from server.base.ThreadBudget import ThreadAllocation
+from server.config.Settings import DetectionSettings
+from server.engine.detection.Message import FrameData
+from server.engine.detection.Processor import DetectionProcessor
+from server.plugin.yolov7 import CLASS_NAMES, MODEL_PATH
+from server.util.onnx import create_session, get_ort_device
 from server.util.types import DeviceType, EngineDevice
 
+_CLASS_NAMES = np.asarray(CLASS_NAMES, dtype=object)
+
+
+def postprocess(
+    output: np.ndarray, ratios: np.ndarray, dwdhs: np.ndarray, num_frames: int
+) -> List[FrameData]:
+    """Turn the `(N, 7)` NMS output into per-frame detections.
+
+    Rows are `batch_id, x0, y0, x1, y1, class_id, score` in letterboxed
+    coordinates; `ratios` and `dwdhs` hold the letterbox scale and padding of
+    each frame. Boxes are mapped back to the source frame in one pass and the
+    rows are grouped by frame, keeping their order within a frame.
+    """
+    batch_ids = output[:, 0].astype(np.int64)
+    order = np.argsort(batch_ids, kind="stable")
+    output = output[order]
+    batch_ids = batch_ids[order]
+
+    boxes = output[:, 1:5] - np.tile(dwdhs, 2)[batch_ids]  # XYXY
+    boxes /= ratios[batch_ids, None]
+    boxes = boxes.round().astype(np.int32)
+    class_ids = output[:, 5].astype(np.int64)
+    scores = output[:, 6].astype(np.float64).round(3)
+    class_names = _CLASS_NAMES[class_ids]
+
+    splits = np.searchsorted(batch_ids, np.arange(1, num_frames))
+    boxes = np.split(boxes, splits)
+    class_ids = np.split(class_ids, splits)
+    scores = np.split(scores, splits)
+    class_names = np.split(class_names, splits)
+
+    return [
+        FrameData(
+            frame_index=index,
+            boxes=boxes[index],
+            class_ids=class_ids[index],
+            scores=scores[index],
+            class_names=class_names[index],
+        )
+        for index in range(num_frames)
+    ]
+
+
+class DetectionBinding:
+    """IO binding of one worker on a (possibly shared) detection session.
+
+    One binding and input `OrtValue` are kept per batch shape, so steady
+    state batches only refill the input. On CPU the value wraps the host batch
+    itself (the reused buffer of a `DetectionProcessor`) and nothing is
+    copied; on GPU the batch is uploaded into a preallocated device tensor.
+    The NMS output has a data dependent number of rows, so it is still
+    allocated by onnxruntime on the bound device.
+    """
+
+    __session: onnxruntime.InferenceSession
+    __input_name: str
+    __output_names: List[str]
+    __device: EngineDevice
+    __bindings: Dict[
+        Tuple[int, ...], Tuple[onnxruntime.IOBinding, onnxruntime.OrtValue]
+    ]
+
+    def __init__(
+        self,
+        session: onnxruntime.InferenceSession,
+        input_name: str,
+        output_names: List[str],
+        device: EngineDevice,
+    ):
+        self.__session = session
+        self.__input_name = input_name
+        self.__output_names = output_names
+        self.__device = device
+        self.__bindings = {}
+
+    def __bind(
+        self, batch: np.ndarray
+    ) -> Tuple[onnxruntime.IOBinding, onnxruntime.OrtValue]:
+        device_type, device_id = get_ort_device(self.__device)
+        if self.__device.mode is DeviceType.CPU:
+            value = onnxruntime.OrtValue.ortvalue_from_numpy(batch)
+        else:
+            value = onnxruntime.OrtValue.ortvalue_from_shape_and_type(
+                batch.shape, batch.dtype.type, device_type, device_id
+            )
+
+        binding = self.__session.io_binding()
+        binding.bind_ortvalue_input(self.__input_name, value)
+        for name in self.__output_names:
+            binding.bind_output(name, device_type, device_id)
+        return binding, value
+
+    def __len__(self) -> int:
+        return len(self.__bindings)
+
+    def run(
+        self, batch: np.ndarray, run_options: onnxruntime.RunOptions = None
+    ) -> np.ndarray:
+        entry = self.__bindings.get(batch.shape)
+        if entry is None or (
+            self.__device.mode is DeviceType.CPU
+            and entry[1].data_ptr() != batch.ctypes.data
+        ):
+            # New batch shape, or the host buffer was reallocated
+            entry = self.__bind(batch)
+            self.__bindings[batch.shape] = entry
+
+        binding, value = entry
+        if self.__device.mode is not DeviceType.CPU:
+            value.update_inplace(batch)
+
+        self.__session.run_with_iobinding(binding, run_options)
+        return binding.get_outputs()[0].numpy()
+
 
 class DetectionModel:
     __device: EngineDevice
@@ -15,77 +134,58 @@ class DetectionModel:
     __input_names: List[str]
     __output_names: List[str]
 
-    def __init__(self, device: EngineDevice):
+    def __init__(
+        self,
+        device: EngineDevice,
+        path: str = MODEL_PATH,
+        setting: DetectionSettings = None,
+        threads: ThreadAllocation = None,
+    ):
         self.__device = device
-
-        providers = ["CPUExecutionProvider"]
-        if self.__device.mode is DeviceType.GPU:
-            providers = [
-                (
-                    "CUDAExecutionProvider",
-                    {
-                        "device_id": str(self.__device.id),
-                        "arena_extend_strategy": "kNextPowerOfTwo",
-                        # 'gpu_mem_limit': 2 * 1024 * 1024 * 1024,
-                        "cudnn_conv_algo_search": "EXHAUSTIVE",
-                        "do_copy_in_default_stream": True,
-                    },
-                ),
-            ]
-
-        self.__session = onnxruntime.InferenceSession(MODEL_PATH, providers=providers)
+        if setting is None:
+            setting = DetectionSettings()
+
+        self.__session = create_session(
+            path,
+            self.__device,
+            optimization=setting.graph_optimization,
+            cache_dir=setting.onnx_cache_dir,
+            threads=threads,
+        )
         self.__input_names = [i.name for i in self.__session.get_inputs()]
         self.__output_names = [i.name for i in self.__session.get_outputs()]
 
-    def __call__(
-        self, frames: List[np.ndarray]
-    ) -> Tuple[List[int], List[List[float]], List[int], List[float], List[str]]:
-        input_frames: List[np.ndarray] = []
-        ratios = []
-        dwdhs = []
+    def io_binding(self) -> DetectionBinding:
+        """A new IO binding on this model, for the exclusive use of one worker."""
+        return DetectionBinding(
+            self.__session, self.__input_names[0], self.__output_names, self.__device
+        )
 
+    def __call__(
+        self,
+        frames: List[np.ndarray],
+        run_options: onnxruntime.RunOptions = None,
+        processor: DetectionProcessor = None,
+        binding: DetectionBinding = None,
+    ) -> List[FrameData]:
+        """Detect objects in `frames`, one `FrameData` per frame in order.
+
+        The model may be shared between workers, so each worker passes its own
+        `processor` and `binding` to reuse its buffers across calls. Without a
+        binding the batch goes through `InferenceSession.run`.
+        """
         if len(frames) <= 0:
             logger.info(f"[{__class__.__name__}] Empty input")
             return []
 
-        for frame in frames:
-            image, ratio, dwdh = letterbox(frame.copy(), auto=False)
-            input_frames.append(image)
-            ratios.append(ratio)
-            dwdhs.append(dwdh)
-
-        frame_batch = np.stack(input_frames).transpose((0, 3, 1, 2))
-        frame_batch = np.ascontiguousarray(frame_batch)
-        frame_batch = frame_batch.astype(np.float32)
-        frame_batch /= 255
-
-        input = {self.__input_names[0]: frame_batch}
-        output = self.__session.run(self.__output_names, input)[0]
-
-        indices: List[int] = []
-        boxes: List[List[float]] = []  # XYXY
-        class_ids: List[int] = []
-        scores: List[float] = []
-        class_names: List[str] = []
-
-        for batch_id, x0, y0, x1, y1, cls_id, score in output:
-            index = int(batch_id)
-            indices.append(index)
-
-            dwdh = dwdhs[index]
-            ratio = ratios[index]
-
-            box: np.ndarray = np.array([x0, y0, x1, y1])
-            box -= np.array(dwdh * 2)
-            box /= ratio
-            box = box.round().astype(np.int32).tolist()
-            cls_id = int(cls_id)
-            score = round(float(score), 3)
-            name = CLASS_NAMES[cls_id]
-
-            boxes.append(box)
-            class_ids.append(cls_id)
-            scores.append(score)
-            class_names.append(name)
-
-        return indices, boxes, class_ids, scores, class_names
+        if processor is None:
+            processor = DetectionProcessor()
+        frame_batch, ratios, dwdhs = processor.pre_process(frames)
+
+        if binding is not None:
+            output = binding.run(frame_batch, run_options)
+        else:
+            input = {self.__input_names[0]: frame_batch}
+            output = self.__session.run(self.__output_names, input, run_options)[0]
+
+        return postprocess(output, ratios, dwdhs, len(frames))
@@ -0,0 +1,84 @@
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+LETTERBOX_COLOR = 114
+
+
+class DetectionProcessor:
+    """Letterbox frames straight into a reusable NCHW float32 batch.
+
+    Each frame is resized into a scratch buffer and written, transposed and
+    normalised, into its slot of the batch. The batch buffer only grows, and
+    the padding of a slot is refilled only when its layout changes, so
+    batches of a video allocate nothing after the first one.
+    """
+
+    __shape: Tuple[int, int]
+    __batch: np.ndarray
+    __scratch: np.ndarray
+    __layouts: List[Optional[Tuple[int, int, int, int]]]
+
+    def __init__(self, shape: Tuple[int, int] = (640, 640)):
+        self.__shape = shape
+        self.__batch = np.empty((0, 3, *shape), dtype=np.float32)
+        self.__scratch = np.empty(shape[0] * shape[1] * 3, dtype=np.uint8)
+        self.__layouts = []
+
+    def __layout(self, shape: Tuple[int, int]) -> Tuple[float, Tuple[int, ...]]:
+        # Same geometry as `letterbox(..., auto=False)`
+        height, width = self.__shape
+        r = min(height / shape[0], width / shape[1])
+        new_w, new_h = int(round(shape[1] * r)), int(round(shape[0] * r))
+        dw, dh = (width - new_w) / 2, (height - new_h) / 2
+        top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+        return r, (top, left, new_h, new_w)
+
+    def __reserve(self, size: int):
+        if len(self.__batch) < size:
+            self.__batch = np.empty((size, 3, *self.__shape), dtype=np.float32)
+            self.__layouts = [None] * size
+
+    def pre_process(
+        self, frames: List[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """HWC uint8 frames -> NCHW float32 batch in [0, 1], ratios and dwdhs.
+
+        The batch is a view of the internal buffer and is overwritten by the
+        next call.
+        """
+        self.__reserve(len(frames))
+        ratios = np.empty(len(frames), dtype=np.float64)
+        dwdhs = np.empty((len(frames), 2), dtype=np.float64)
+
+        for index, frame in enumerate(frames):
+            r, layout = self.__layout(frame.shape[:2])
+            top, left, new_h, new_w = layout
+            ratios[index] = r
+            dwdhs[index] = (
+                (self.__shape[1] - new_w) / 2,
+                (self.__shape[0] - new_h) / 2,
+            )
+
+            slot = self.__batch[index]
+            if self.__layouts[index] != layout:
+                slot.fill(LETTERBOX_COLOR / 255)
+                self.__layouts[index] = layout
+
+            if frame.shape[:2] != (new_h, new_w):
+                resized = self.__scratch[: new_h * new_w * 3].reshape(new_h, new_w, 3)
+                cv2.resize(
+                    frame, (new_w, new_h), dst=resized, interpolation=cv2.INTER_LINEAR
+                )
+                frame = resized
+
+            np.divide(
+                frame.transpose(2, 0, 1),
+                255,
+                out=slot[:, top : top + new_h, left : left + new_w],
+                dtype=np.float32,
+                casting="unsafe",
+            )
+
+        return self.__batch[: len(frames)], ratios, dwdhs
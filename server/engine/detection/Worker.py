@@ -1,143 +1,241 @@
 """Worker impl module."""
+import time
 from io import BytesIO
-from typing import List
+from queue import Empty
+from typing import List, Optional, Tuple
 
 import cv2
 import numpy as np
-from imutils.video import FileVideoStream
+import onnxruntime
 from loguru import logger
 from PIL import Image
 
 from server.base.Message import BaseFailed
+from server.base.ModelRegistry import ModelRegistry
+from server.base.ThreadBudget import ThreadAllocation
 from server.base.Worker import BaseWorker
+from server.config.Settings import DetectionSettings
 from server.engine.detection.Message import (
-    Box,
     DetectionInputType,
     DetectionResult,
     DetectionTask,
     FrameData,
-    PatchData,
 )
-from server.engine.detection.Model import DetectionModel
+from server.engine.detection.Model import DetectionBinding, DetectionModel
+from server.engine.detection.Processor import DetectionProcessor
 from server.util.types import EngineDevice
 from server.util.util import create_timestamp
+from server.util.video import VideoBatchReader
 
 
 class DetectionWorker(BaseWorker):
     __model: DetectionModel
+    __models: Optional[ModelRegistry[DetectionModel]]
+    __setting: Optional[DetectionSettings]
+    __processor: DetectionProcessor
+    __binding: Optional[DetectionBinding]
+    __run_options: onnxruntime.RunOptions
 
     __batch_size: int
+    __batch_timeout: int
+    __io_binding: bool
 
     def __init__(
-        self, device: EngineDevice = None, batch_size: int = 32, queue_size: int = 100
+        self,
+        device: EngineDevice = None,
+        batch_size: int = 32,
+        batch_timeout: int = 5,
+        io_binding: bool = True,
+        queue_size: int = 100,
+        models: ModelRegistry[DetectionModel] = None,
+        setting: DetectionSettings = None,
+        threads: ThreadAllocation = None,
     ):
+        self.__model = None
+        self.__models = models
+        self.__setting = setting
         self.__batch_size = batch_size
+        self.__batch_timeout = batch_timeout
+        self.__io_binding = io_binding
         if device is None:
             device = EngineDevice()
 
-        super().__init__(queue_size=queue_size, device=device)
+        super().__init__(queue_size=queue_size, device=device, threads=threads)
 
     def init(self):
-        self.__model = DetectionModel(device=self.device)
+        if self.__models is not None:
+            self.__model = self.__models.acquire(self.device)
+        else:
+            self.__model = DetectionModel(
+                device=self.device, setting=self.__setting, threads=self.threads
+            )
+        self.__processor = DetectionProcessor()
+        self.__binding = self.__model.io_binding() if self.__io_binding else None
+
+        # Runs of workers sharing a session are told apart in ORT logs
+        self.__run_options = onnxruntime.RunOptions()
+        self.__run_options.logid = self.id
         logger.info(f"[{self.__class__.__name__}] worker ready")
 
+    def release(self):
+        if self.__models is not None and self.__model is not None:
+            self.__models.release(self.device)
+
     def __transform(self, frame):
         if frame is None:
             return None
         frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         return frame
 
-    def __process_video(self, video_path: str) -> List[FrameData]:
+    def __process_video(self, task: DetectionTask) -> List[FrameData]:
+        """Detect objects in every frame of a video.
+
+        For streaming tasks each batch is published as a partial result and
+        dropped instead of being accumulated, so the final result is empty.
+        """
+        results: List[FrameData] = []
+        num_frames = 0
+
+        with VideoBatchReader(
+            path=task.video_path,
+            batch_size=self.__batch_size,
+            transform=self.__transform,
+        ) as reader:
+            for batch in reader:
+                start = num_frames
+                num_frames += len(batch)
+
+                ts_start = create_timestamp()
+                frames = self.__model(
+                    frames=batch,
+                    run_options=self.__run_options,
+                    processor=self.__processor,
+                    binding=self.__binding,
+                )
+                ts_end = create_timestamp()
 
-        frame_indices: List[int] = []
-        frames: List[np.ndarray] = []
+                logger.info(
+                    f"[{__class__.__name__}] Batch size {len(batch)}: {ts_end - ts_start} ms"
+                )
+
+                for frame in frames:
+                    frame.frame_index += start
+
+                if not task.stream:
+                    results.extend(frames)
+                elif not self.publish(DetectionResult(data=frames, task_id=task.id)):
+                    logger.info(
+                        f"[{__class__.__name__}] Task `{task.id}` abandoned at frame {num_frames}"
+                    )
+                    break
+
+        return results
+
+    def __collect(
+        self, task: DetectionTask
+    ) -> Tuple[List[DetectionTask], Optional[DetectionTask]]:
+        """Coalesce queued image tasks into one batch.
+
+        Image tasks are drained from the queue until `batch_size` images are
+        collected or `batch_timeout` ms have passed since the first one. The
+        first task that cannot join the batch is returned to be handled next.
+        """
+        if task.input_type != DetectionInputType.IMAGE:
+            return [task], None
+
+        tasks: List[DetectionTask] = [task]
+        num_images = len(task.image_data)
+        deadline = time.monotonic() + self.__batch_timeout / 1000.0
+
+        while num_images < self.__batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    msg: DetectionTask = self.queue.get(timeout=remaining)
+                else:
+                    msg: DetectionTask = self.queue.get_nowait()
+            except Empty:
+                break
+
+            if (
+                msg.input_type != DetectionInputType.IMAGE
+                or num_images + len(msg.image_data) > self.__batch_size
+            ):
+                return tasks, msg
 
-        stream = FileVideoStream(path=video_path, transform=self.__transform).start()
+            tasks.append(msg)
+            num_images += len(msg.image_data)
 
-        index = 0
-        while stream.running():
-            frame = stream.read()  # HWC
-            if frame is None:
+        return tasks, None
+
+    def __process_images(self, tasks: List[DetectionTask]):
+        frames: List[np.ndarray] = []
+        outputs: List[FrameData] = []
+        results: List[Tuple[DetectionTask, int]] = []
+
+        for task in tasks:
+            try:
+                images = [
+                    np.asarray(Image.open(BytesIO(bimage)).convert("RGB"))  # HWC
+                    for bimage in task.image_data
+                ]
+            except Exception as e:
+                logger.warning(
+                    f"[{__class__.__name__}] Invalid image in task `{task.id}`: {e}"
+                )
+                self.emit(BaseFailed(task_id=task.id))
                 continue
-            frames.append(frame)
-            frame_indices.append(index)
-            index += 1
 
-        results: List[FrameData] = [
-            FrameData(frame_index=i, patches=[]) for i in range(index)
-        ]
+            frames.extend(images)
+            results.append((task, len(images)))
 
-        target_length = len(frame_indices)
+        target_length = len(frames)
         for start in range(0, target_length, self.__batch_size):
             end = min(start + self.__batch_size, target_length)
             batch = frames[start:end]
 
             ts_start = create_timestamp()
-            indices, boxes, class_ids, scores, class_names = self.__model(frames=batch)
+            outputs.extend(
+                self.__model(
+                    frames=batch,
+                    run_options=self.__run_options,
+                    processor=self.__processor,
+                    binding=self.__binding,
+                )
+            )
             ts_end = create_timestamp()
 
             logger.info(
-                f"[{__class__.__name__}] Batch size {len(batch)}: {ts_end - ts_start} ms"
+                f"[{__class__.__name__}] Batch size {len(batch)} from {len(results)} tasks: {ts_end - ts_start} ms"
             )
 
-            for index, box, class_id, score, class_name in zip(
-                indices, boxes, class_ids, scores, class_names
-            ):
-                patch = PatchData(
-                    box=Box(x1=box[0], y1=box[1], x2=box[2], y2=box[3]),
-                    class_id=class_id,
-                    score=score,
-                    class_name=class_name,
-                )
-                results[start + index].patches.append(patch)
-
-        return results
-
-    def __process_image(self, bimages: List[bytes]) -> List[FrameData]:
-        batch = []
-        for bimage in bimages:
-            image = np.asarray(Image.open(BytesIO(bimage)).convert("RGB"))  # HWC
-            batch.append(image)
-
-        num_images = len(batch)
-
-        ts_start = create_timestamp()
-        indices, boxes, class_ids, scores, class_names = self.__model(frames=batch)
-        ts_end = create_timestamp()
-
-        logger.info(
-            f"[{__class__.__name__}] Batch size {len(batch)}: {ts_end - ts_start} ms"
-        )
-
-        results: List[FrameData] = [
-            FrameData(frame_index=i, patches=[]) for i in range(num_images)
-        ]
-
-        for index, box, class_id, score, class_name in zip(
-            indices, boxes, class_ids, scores, class_names
-        ):
-            patch = PatchData(
-                box=Box(x1=box[0], y1=box[1], x2=box[2], y2=box[3]),
-                class_id=class_id,
-                score=score,
-                class_name=class_name,
-            )
-            results[index].patches.append(patch)
-        return results
-
-    def process(self, task: DetectionTask):
-        if task.input_type == DetectionInputType.IMAGE:
-            ret = self.__process_image(task.image_data)
-            self.sink.put(DetectionResult(data=ret, task_id=task.id))
-        elif task.input_type == DetectionInputType.VIDEO:
-            ret = self.__process_video(task.video_path)
-            self.sink.put(DetectionResult(data=ret, task_id=task.id))
+        # Frames are numbered within their own task
+        offset = 0
+        for task, num_images in results:
+            data = outputs[offset : offset + num_images]
+            for index, frame in enumerate(data):
+                frame.frame_index = index
+            offset += num_images
+            self.emit(DetectionResult(data=data, task_id=task.id))
+
+    def process(self, tasks: List[DetectionTask]):
+        input_type = tasks[0].input_type
+        if input_type == DetectionInputType.IMAGE:
+            self.__process_images(tasks)
+        elif input_type == DetectionInputType.VIDEO:
+            for task in tasks:
+                ret = self.__process_video(task)
+                self.emit(DetectionResult(data=ret, task_id=task.id))
         else:
-            raise RuntimeError(f"Invalid input type: {task.input_type}")
-
-    def handle(self, msg: DetectionTask) -> DetectionResult:
-        try:
-            self.process(msg)
-        except Exception as e:
-            self.sink.put(BaseFailed(task_id=msg.id))
-            raise RuntimeError(f"Failed to process task `{msg.id}`: {e}")
+            raise RuntimeError(f"Invalid input type: {input_type}")
+
+    def handle(self, msg: DetectionTask):
+        while msg is not None:
+            tasks, msg = self.__collect(msg)
+            try:
+                self.process(tasks)
+            except Exception as e:
+                for task in tasks:
+                    if task.id in self.registry:
+                        self.emit(BaseFailed(task_id=task.id))
+                        logger.warning(f"Failed to process task `{task.id}`: {e}")
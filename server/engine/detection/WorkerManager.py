@@ -1,37 +1,90 @@
 """WorkerManager impl module."""
-from typing import List
+import contextlib
+from typing import List, Optional
 
+from server.base.ModelRegistry import ModelRegistry
+from server.base.ProcessWorker import ProcessWorker
+from server.base.ThreadBudget import ThreadBudget
 from server.base.Worker import BaseWorker
 from server.base.WorkerManager import BaseWorkerManager
-from server.config.Settings import Settings
+from server.config.Settings import DetectionSettings, Settings
+from server.engine.detection.Model import DetectionModel
 from server.engine.detection.Worker import DetectionWorker
-from server.util.types import EngineDevice
+from server.util.types import EngineDevice, WorkerBackend
 
 
 class DetectionWorkerManager(BaseWorkerManager):
+    __setting: DetectionSettings
     __batch_size: int
+    __batch_timeout: int
+    __io_binding: bool
+    __backend: WorkerBackend
+    __models: Optional[ModelRegistry[DetectionModel]]
 
     def __init__(
         self,
         setting: Settings,
     ):
-        worker_num = setting.server.worker_num
-        self.__batch_size = setting.server.worker_batch_size
-        worker_queue_size = setting.server.worker_queue_size
-        devices = [EngineDevice(dev) for dev in setting.server.devices]
+        self.__setting = setting.detection
+        self.__backend = setting.server.worker_backend
+        self.__models = None
+        if setting.server.worker_share_model and self.__backend is WorkerBackend.THREAD:
+            self.__models = ModelRegistry(factory=self.__load_model)
+        self.__batch_size = self.__setting.batch_size(setting.server)
+        self.__batch_timeout = self.__setting.batch_timeout(setting.server)
+        self.__io_binding = self.__setting.io_binding
+
+        # One device instance per id, shared by the workers on it
+        workers = self.__setting.workers(setting.server)
+        devices = {dev: EngineDevice(dev) for dev in set(workers)}
+        threads = None
+        if setting.server.thread_budget:
+            budget = ThreadBudget(
+                cores=setting.server.thread_budget_cores,
+                pin=setting.server.thread_pinning,
+            )
+            threads = budget.allocate(setting.worker_pools())["detection"]
+
         super().__init__(
-            worker_num=worker_num, devices=devices, queue_size=worker_queue_size
+            worker_devices=[devices[dev] for dev in workers],
+            worker_threads=threads,
+            queue_size=self.__setting.queue_size(setting.server),
+            policy=setting.server.worker_schedule_policy,
         )
 
+    def __load_model(self, device: EngineDevice) -> DetectionModel:
+        # Pools of a shared session serve every worker on the device
+        threads = self.device_threads(device)
+        with threads.pinned() if threads is not None else contextlib.nullcontext():
+            return DetectionModel(
+                device=device, setting=self.__setting, threads=threads
+            )
+
     def init(self):
-        device_num = len(self.devices)
         workers: List[BaseWorker] = []
-        for i in range(self.worker_num):
-            worker = DetectionWorker(
-                device=self.devices[i % device_num],
-                batch_size=self.__batch_size,
-                queue_size=self.worker_queue_size,
-            )
+        for device, threads in zip(self.worker_devices, self.worker_threads):
+            if self.__backend is WorkerBackend.PROCESS:
+                worker = ProcessWorker(
+                    DetectionWorker,
+                    device=device,
+                    queue_size=self.worker_queue_size,
+                    batch_size=self.__batch_size,
+                    batch_timeout=self.__batch_timeout,
+                    io_binding=self.__io_binding,
+                    setting=self.__setting,
+                    threads=threads,
+                )
+            else:
+                worker = DetectionWorker(
+                    device=device,
+                    batch_size=self.__batch_size,
+                    batch_timeout=self.__batch_timeout,
+                    io_binding=self.__io_binding,
+                    queue_size=self.worker_queue_size,
+                    models=self.__models,
+                    setting=self.__setting,
+                    threads=threads,
+                )
             worker.start()
             workers.append(worker)
 
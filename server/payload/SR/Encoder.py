@@ -0,0 +1,128 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from attrs import define
+
+from server.config.Settings import SRSettings
+from server.payload.SR.Response import SRResponse
+from server.util.types import SROutputFormat
+
+SR_MEDIA_TYPES: Dict[SROutputFormat, str] = {
+    SROutputFormat.PNG: "image/png",
+    SROutputFormat.WEBP: "image/webp",
+    SROutputFormat.JPEG: "image/jpeg",
+    SROutputFormat.RAW: "application/octet-stream",
+}
+
+
+@define
+class SREncodeOptions:
+    format: SROutputFormat = SROutputFormat.PNG
+    quality: int = 95  # JPEG, lossy WebP
+    compression: int = 1  # PNG
+    lossless: bool = False  # WebP
+
+
+def parse_accept(accept: str) -> Optional[SROutputFormat]:
+    """Pick the preferred supported output format from an `Accept` header."""
+    candidates: List[Tuple[float, int, str]] = []
+    for index, item in enumerate(accept.split(",")):
+        media_type, *params = [p.strip() for p in item.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type and q > 0:
+            candidates.append((-q, index, media_type.lower()))
+
+    for _, _, media_type in sorted(candidates):
+        for output_format, _media_type in SR_MEDIA_TYPES.items():
+            if media_type == _media_type:
+                return output_format
+    return None
+
+
+class SREncoder:
+    """Encode SR results on a dedicated thread pool.
+
+    OpenCV releases the GIL while encoding, so large outputs are compressed in
+    parallel without blocking the event loop.
+    """
+
+    __setting: SRSettings
+    __pool: ThreadPoolExecutor
+
+    def __init__(self, setting: SRSettings = None):
+        self.__setting = setting or SRSettings()
+        self.__pool = ThreadPoolExecutor(
+            max_workers=self.__setting.encode_workers, thread_name_prefix="sr-encode"
+        )
+
+    def options(
+        self,
+        format: SROutputFormat = None,
+        accept: str = None,
+        quality: int = None,
+        compression: int = None,
+        lossless: bool = False,
+    ) -> SREncodeOptions:
+        """Resolve encoding options, an explicit format wins over `Accept`."""
+        if format is None and accept:
+            format = parse_accept(accept)
+
+        return SREncodeOptions(
+            format=format or self.__setting.output_format,
+            quality=quality or self.__setting.output_quality,
+            compression=(
+                self.__setting.output_png_compression
+                if compression is None
+                else compression
+            ),
+            lossless=lossless,
+        )
+
+    @staticmethod
+    def encode(image: np.ndarray, options: SREncodeOptions) -> SRResponse:
+        """Encode an HWC BGR uint8 image."""
+        headers = {}
+
+        if options.format is SROutputFormat.RAW:
+            height, width, channels = image.shape
+            content = cv2.cvtColor(image, cv2.COLOR_BGR2RGB).tobytes()
+            headers["X-Image-Shape"] = f"{height},{width},{channels}"
+        else:
+            if options.format is SROutputFormat.PNG:
+                params = [cv2.IMWRITE_PNG_COMPRESSION, options.compression]
+            elif options.format is SROutputFormat.JPEG:
+                params = [cv2.IMWRITE_JPEG_QUALITY, options.quality]
+            else:
+                # OpenCV switches WebP to lossless for a quality above 100
+                quality = 101 if options.lossless else options.quality
+                params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+
+            ok, data = cv2.imencode(f".{options.format.value}", image, params)
+            if not ok:
+                raise RuntimeError(f"Failed to encode image as {options.format.value}")
+            content = data.tobytes()
+
+        return SRResponse(
+            content=content,
+            media_type=SR_MEDIA_TYPES[options.format],
+            headers=headers,
+        )
+
+    async def encode_async(
+        self, image: np.ndarray, options: SREncodeOptions
+    ) -> SRResponse:
+        return await asyncio.wrap_future(
+            self.__pool.submit(self.encode, image, options)
+        )
+
+    def shutdown(self):
+        self.__pool.shutdown(wait=True)
@@ -1,4 +1,5 @@
-import cv2
+from typing import Any, Dict, List
+
 from pydantic import BaseModel, Field
 
 from server.util.types import ServerStatus
@@ -11,3 +12,8 @@ class Health(BaseModel):
 
     class Config:
         use_enum_values = True
+
+
+class Metrics(BaseModel):
+    super_resolution: List[Dict[str, Any]] = Field(default_factory=list)
+    detection: List[Dict[str, Any]] = Field(default_factory=list)
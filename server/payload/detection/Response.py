@@ -1,19 +1,18 @@
 from typing import List, Optional
 
-import cv2
-from fastapi import Response
 from pydantic import BaseModel
 
-from server.engine.detection.Message import PatchData
-from server.engine.SR.Message import SRResult
-
-
-class SRResponse(Response):
-    def __init__(self, result: SRResult):
-        _, data_png = cv2.imencode(".png", cv2.cvtColor(result.data, cv2.COLOR_RGB2BGR))
-        super().__init__(content=data_png.tobytes(), media_type="image/png")
+from server.engine.detection.Message import FrameData, PatchData
 
 
 class DetectionResponse(BaseModel):
     frame_index: Optional[int]
     patches: List[PatchData]
+
+    @classmethod
+    def from_frame(cls, frame: FrameData, frame_index: bool = True):
+        """Materialise the patches of `frame`, only needed when serializing."""
+        return cls(
+            frame_index=frame.frame_index if frame_index else None,
+            patches=frame.patches,
+        )
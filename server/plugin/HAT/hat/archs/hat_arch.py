@@ -1,5 +1,7 @@
 import math
+import threading
 import torch
+from collections import OrderedDict
 import torch.nn as nn
 import torch.utils.checkpoint as checkpoint
 
@@ -120,9 +122,11 @@ def window_reverse(windows, window_size, h, w):
     Returns:
         x: (b, h, w, c)
     """
-    b = int(windows.shape[0] / (h * w / window_size / window_size))
-    x = windows.view(b, h // window_size, w // window_size, window_size, window_size, -1)
-    x = x.permute(0, 1, 3, 2, 4, 5).contiguous().view(b, h, w, -1)
+    # infer b from the tensor rather than int(), so traced / exported graphs
+    # keep a dynamic batch size
+    c = windows.shape[-1]
+    x = windows.view(-1, h // window_size, w // window_size, window_size, window_size, c)
+    x = x.permute(0, 1, 3, 2, 4, 5).contiguous().view(-1, h, w, c)
     return x
 
 
@@ -733,6 +737,7 @@ class HAT(nn.Module):
         img_range: Image range. 1. or 255.
         upsampler: The reconstruction reconstruction module. 'pixelshuffle'/'pixelshuffledirect'/'nearest+conv'/None
         resi_connection: The convolutional block before residual connection. '1conv'/'3conv'
+        mask_cache_size (int): Number of attention masks cached per input size, device and dtype. 0 disables. Default: 8
     """
 
     def __init__(self,
@@ -761,6 +766,7 @@ class HAT(nn.Module):
                  img_range=1.,
                  upsampler='',
                  resi_connection='1conv',
+                 mask_cache_size=8,
                  **kwargs):
         super(HAT, self).__init__()
 
@@ -780,6 +786,13 @@ class HAT(nn.Module):
         self.upscale = upscale
         self.upsampler = upsampler
 
+        # LRU cache of attention masks keyed by (h, w, device, dtype)
+        self.mask_cache_size = mask_cache_size
+        self.mask_cache = OrderedDict()
+        self.mask_cache_hits = 0
+        self.mask_cache_misses = 0
+        self.mask_cache_lock = threading.Lock()
+
         # relative position index
         relative_position_index_SA = self.calculate_rpi_sa()
         relative_position_index_OCA = self.calculate_rpi_oca()
@@ -939,6 +952,40 @@ class HAT(nn.Module):
 
         return attn_mask
 
+    def get_mask(self, x_size, device, dtype):
+        """Return the attention mask for `x_size`, reusing a cached copy on `device`."""
+        if torch.onnx.is_in_onnx_export():
+            # keep the mask computation in the exported graph for dynamic sizes
+            return self.calculate_mask(x_size).to(device=device, dtype=dtype)
+
+        key = (x_size[0], x_size[1], str(device), dtype)
+        with self.mask_cache_lock:
+            attn_mask = self.mask_cache.get(key)
+            if attn_mask is not None:
+                self.mask_cache.move_to_end(key)
+                self.mask_cache_hits += 1
+                return attn_mask
+            self.mask_cache_misses += 1
+
+        attn_mask = self.calculate_mask(x_size).to(device=device, dtype=dtype)
+
+        if self.mask_cache_size > 0:
+            with self.mask_cache_lock:
+                self.mask_cache[key] = attn_mask
+                self.mask_cache.move_to_end(key)
+                while len(self.mask_cache) > self.mask_cache_size:
+                    self.mask_cache.popitem(last=False)
+        return attn_mask
+
+    def mask_cache_info(self):
+        with self.mask_cache_lock:
+            return {
+                'hits': self.mask_cache_hits,
+                'misses': self.mask_cache_misses,
+                'size': len(self.mask_cache),
+                'max_size': self.mask_cache_size
+            }
+
     @torch.jit.ignore
     def no_weight_decay(self):
         return {'absolute_pos_embed'}
@@ -952,7 +999,7 @@ class HAT(nn.Module):
 
         # Calculate attention mask and relative position index in advance to speed up inference. 
         # The original code is very time-cosuming for large window size.
-        attn_mask = self.calculate_mask(x_size).to(x.device)
+        attn_mask = self.get_mask(x_size, x.device, x.dtype)
         params = {'attn_mask': attn_mask, 'rpi_sa': self.relative_position_index_SA, 'rpi_oca': self.relative_position_index_OCA}
 
         x = self.patch_embed(x)
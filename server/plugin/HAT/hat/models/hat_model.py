@@ -12,17 +12,32 @@ from .sr_model import SRModel
 
 
 class HATModel(SRModel):
-    def pre_process(self):
-        # pad to multiplication of window_size
+    def _bucket_size(self, size):
+        """Smallest configured bucket holding `size`, else the next window multiple."""
+        window_size = self.opt["network_g"]["window_size"]
+        for bucket in self.opt.get("buckets", []):
+            if bucket >= size:
+                return bucket
+        return math.ceil(size / window_size) * window_size
+
+    def pre_process(self, bucket=False):
+        # pad to multiplication of window_size, or with `bucket` to the
+        # smallest configured bucket so that repeated sizes share one shape
         window_size = self.opt["network_g"]["window_size"]
         self.scale = self.opt.get("scale", 1)
         self.mod_pad_h, self.mod_pad_w = 0, 0
         _, _, h, w = self.lq.size()
-        if h % window_size != 0:
-            self.mod_pad_h = window_size - h % window_size
-        if w % window_size != 0:
-            self.mod_pad_w = window_size - w % window_size
-        self.img = F.pad(self.lq, (0, self.mod_pad_w, 0, self.mod_pad_h), "reflect")
+        if bucket and self.opt.get("buckets"):
+            self.mod_pad_h = self._bucket_size(h) - h
+            self.mod_pad_w = self._bucket_size(w) - w
+        else:
+            if h % window_size != 0:
+                self.mod_pad_h = window_size - h % window_size
+            if w % window_size != 0:
+                self.mod_pad_w = window_size - w % window_size
+        # reflect padding must be smaller than the padded dimension
+        mode = "reflect" if self.mod_pad_h < h and self.mod_pad_w < w else "replicate"
+        self.img = F.pad(self.lq, (0, self.mod_pad_w, 0, self.mod_pad_h), mode)
 
     def process(self):
         # model inference
@@ -36,95 +51,106 @@ class HATModel(SRModel):
                 self.output = self.net_g(self.img)
             # self.net_g.train()
 
+    def _tile_weights(self, starts, window, core_starts, size, feather):
+        """Per-tile 1D blending weights along one axis, in output resolution.
+
+        Weights are 1 on the tile core. With `feather` they ramp down linearly
+        across the padded overlap instead of dropping to 0, so neighbouring
+        tiles are blended rather than cut at the core boundary.
+        """
+        scale = self.opt["scale"]
+        tile_size = self.opt["tile"]["tile_size"]
+        tile_pad = self.opt["tile"]["tile_pad"]
+        positions = torch.arange(window * scale, device=self.img.device)
+        core_start = (core_starts - starts) * scale
+        core_end = (torch.clamp(core_starts + tile_size, max=size) - starts) * scale
+
+        distance = torch.maximum(
+            core_start[:, None] - positions[None, :],
+            positions[None, :] - (core_end[:, None] - 1),
+        ).clamp(min=0)
+
+        if not feather:
+            return (distance == 0).to(self.img.dtype)
+
+        ramp = tile_pad * scale + 1
+        return (1 - distance / ramp).clamp(min=0).to(self.img.dtype)
+
     def tile_process(self):
         """It will first crop input images to tiles, and then process each tile.
         Finally, all the processed tiles are merged into one images.
+
+        Every tile window has the same padded shape (windows at the border are
+        shifted inwards instead of clipped), so tiles are stacked into batches
+        of `tile.batch_size` per forward pass. Outputs are stitched with a
+        weighted scatter-add over precomputed flat indices; `tile.feather`
+        enables linear blending across the padded overlaps.
         Modified from: https://github.com/ata4/esrgan-launcher
         """
         batch, channel, height, width = self.img.shape
-        output_height = height * self.scale
-        output_width = width * self.scale
-        output_shape = (batch, channel, output_height, output_width)
-
-        # start with black image
-        self.output = self.img.new_zeros(output_shape)
-        tiles_x = math.ceil(width / self.opt["tile"]["tile_size"])
-        tiles_y = math.ceil(height / self.opt["tile"]["tile_size"])
-
-        # loop over all tiles
-        for y in range(tiles_y):
-            for x in range(tiles_x):
-                # extract tile from input image
-                ofs_x = x * self.opt["tile"]["tile_size"]
-                ofs_y = y * self.opt["tile"]["tile_size"]
-                # input tile area on total image
-                input_start_x = ofs_x
-                input_end_x = min(ofs_x + self.opt["tile"]["tile_size"], width)
-                input_start_y = ofs_y
-                input_end_y = min(ofs_y + self.opt["tile"]["tile_size"], height)
-
-                # input tile area on total image with padding
-                input_start_x_pad = max(input_start_x - self.opt["tile"]["tile_pad"], 0)
-                input_end_x_pad = min(input_end_x + self.opt["tile"]["tile_pad"], width)
-                input_start_y_pad = max(input_start_y - self.opt["tile"]["tile_pad"], 0)
-                input_end_y_pad = min(
-                    input_end_y + self.opt["tile"]["tile_pad"], height
-                )
-
-                # input tile dimensions
-                input_tile_width = input_end_x - input_start_x
-                input_tile_height = input_end_y - input_start_y
-                tile_idx = y * tiles_x + x + 1
-                input_tile = self.img[
-                    :,
-                    :,
-                    input_start_y_pad:input_end_y_pad,
-                    input_start_x_pad:input_end_x_pad,
+        scale = self.opt["scale"]
+        tile_size = self.opt["tile"]["tile_size"]
+        tile_pad = self.opt["tile"]["tile_pad"]
+        tile_batch_size = max(self.opt["tile"].get("batch_size", 1), 1)
+        feather = self.opt["tile"].get("feather", False)
+        device = self.img.device
+
+        window_h = min(tile_size + 2 * tile_pad, height)
+        window_w = min(tile_size + 2 * tile_pad, width)
+
+        # tile cores partition the image; windows add the padding around them
+        core_y = torch.arange(0, height, tile_size, device=device)
+        core_x = torch.arange(0, width, tile_size, device=device)
+        start_y = torch.clamp(core_y - tile_pad, min=0, max=height - window_h)
+        start_x = torch.clamp(core_x - tile_pad, min=0, max=width - window_w)
+
+        weight_y = self._tile_weights(start_y, window_h, core_y, height, feather)
+        weight_x = self._tile_weights(start_x, window_w, core_x, width, feather)
+
+        # all tiles in row-major order
+        tiles_y, tiles_x = len(core_y), len(core_x)
+        tile_y = torch.arange(tiles_y, device=device).repeat_interleave(tiles_x)
+        tile_x = torch.arange(tiles_x, device=device).repeat(tiles_y)
+
+        output_width = width * scale
+        rows = start_y[:, None] * scale + torch.arange(window_h * scale, device=device)
+        cols = start_x[:, None] * scale + torch.arange(window_w * scale, device=device)
+
+        output = self.img.new_zeros((batch, channel, height * scale * output_width))
+        weight_sum = self.img.new_zeros((height * scale * output_width,))
+
+        net_g = self.net_g_ema if hasattr(self, "net_g_ema") else self.net_g
+        net_g.eval()
+
+        for start in range(0, len(tile_y), tile_batch_size):
+            ty = tile_y[start : start + tile_batch_size]
+            tx = tile_x[start : start + tile_batch_size]
+            num_tiles = len(ty)
+
+            input_tiles = torch.cat(
+                [
+                    self.img[:, :, y0 : y0 + window_h, x0 : x0 + window_w]
+                    for y0, x0 in zip(start_y[ty].tolist(), start_x[tx].tolist())
                 ]
+            )
 
-                # upscale tile
-                try:
-                    if hasattr(self, "net_g_ema"):
-                        self.net_g_ema.eval()
-                        with torch.no_grad():
-                            output_tile = self.net_g_ema(input_tile)
-                    else:
-                        self.net_g.eval()
-                        with torch.no_grad():
-                            output_tile = self.net_g(input_tile)
-                except RuntimeError as error:
-                    print("Error", error)
-                print(f"\tTile {tile_idx}/{tiles_x * tiles_y}")
-
-                # output tile area on total image
-                output_start_x = input_start_x * self.opt["scale"]
-                output_end_x = input_end_x * self.opt["scale"]
-                output_start_y = input_start_y * self.opt["scale"]
-                output_end_y = input_end_y * self.opt["scale"]
-
-                # output tile area without padding
-                output_start_x_tile = (input_start_x - input_start_x_pad) * self.opt[
-                    "scale"
-                ]
-                output_end_x_tile = (
-                    output_start_x_tile + input_tile_width * self.opt["scale"]
-                )
-                output_start_y_tile = (input_start_y - input_start_y_pad) * self.opt[
-                    "scale"
-                ]
-                output_end_y_tile = (
-                    output_start_y_tile + input_tile_height * self.opt["scale"]
-                )
+            # upscale tiles
+            with torch.no_grad():
+                output_tiles = net_g(input_tiles)
 
-                # put tile into output image
-                self.output[
-                    :, :, output_start_y:output_end_y, output_start_x:output_end_x
-                ] = output_tile[
-                    :,
-                    :,
-                    output_start_y_tile:output_end_y_tile,
-                    output_start_x_tile:output_end_x_tile,
-                ]
+            # flat output index and blending weight of every tile pixel
+            index = (rows[ty][:, :, None] * output_width + cols[tx][:, None, :]).view(
+                -1
+            )
+            weight = weight_y[ty][:, :, None] * weight_x[tx][:, None, :]
+
+            values = output_tiles.view(num_tiles, batch, channel, *weight.shape[1:])
+            values = (values * weight[:, None, None]).permute(1, 2, 0, 3, 4)
+            output.index_add_(2, index, values.reshape(batch, channel, -1))
+            weight_sum.index_add_(0, index, weight.view(-1))
+
+        output /= weight_sum
+        self.output = output.view(batch, channel, height * scale, output_width)
 
     def post_process(self):
         _, _, h, w = self.output.size()
@@ -14,9 +14,14 @@ from .base_model import BaseModel
 class SRModel(BaseModel):
     """Base SR model for single image super-resolution."""
 
-    def __init__(self, opt, device: str = "cpu"):
+    def __init__(self, opt, device: str = "cpu", net_g=None):
         super(SRModel, self).__init__(opt, device)
 
+        if net_g is not None:
+            # prebuilt inference network (e.g. an exported graph), nothing to load
+            self.net_g = net_g
+            return
+
         # define network
         self.net_g = build_network(opt["network_g"])
         self.net_g = self.model_to_device(self.net_g)
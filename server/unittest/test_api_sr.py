@@ -1,11 +1,13 @@
+import asyncio
 import io
 import json
 import time
 from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
+import cv2
 import numpy as np
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.testclient import TestClient
 from loguru import logger
 from PIL import Image
@@ -13,11 +15,12 @@ from pydantic.json import pydantic_encoder
 from requests import Response
 
 from server.application import Application
-from server.config.Settings import Settings
-from server.controller import router
+from server.config.Settings import Settings, SRSettings
+from server.controller import read_sr_task, router
 from server.payload.actuator.Response import Health
+from server.payload.SR.Encoder import SREncoder, parse_accept
 from server.payload.SR.Request import SRRequest
-from server.util.types import ServerStatus
+from server.util.types import ServerStatus, SROutputFormat
 from server.util.util import create_timestamp
 
 from .mock import TaskType, prepare_output_dir, prepare_requests, save_image
@@ -131,3 +134,93 @@ class TestApi:
                 output_dir=self.__output_dir,
                 filename=f"{index}.png",
             )
+
+
+def prepare_sr_task_client() -> TestClient:
+    server = FastAPI()
+
+    @server.post("/task")
+    async def parse(request: Request):
+        task = await read_sr_task(request)
+        return {
+            "image": task.image,
+            "image_data": len(task.image_data) if task.image_data else None,
+        }
+
+    return TestClient(server)
+
+
+def test_sr_request_body_types():
+    client = prepare_sr_task_client()
+    image = b"\x89PNG fake image bytes"
+
+    response = client.post(url="/task", json={"data": "aGVsbG8="})
+    assert response.json() == {"image": "aGVsbG8=", "image_data": None}
+
+    response = client.post(url="/task", files={"file": ("a.png", image)})
+    assert response.json() == {"image": None, "image_data": len(image)}
+
+    for content_type in ("image/png", "application/octet-stream"):
+        response = client.post(
+            url="/task", content=image, headers={"content-type": content_type}
+        )
+        assert response.json() == {"image": None, "image_data": len(image)}
+
+    response = client.post(url="/task", json={"invalid": "payload"})
+    assert response.status_code == 422
+
+    response = client.post(
+        url="/task", content=b"", headers={"content-type": "image/png"}
+    )
+    assert response.status_code == 422
+
+
+def test_sr_output_negotiation():
+    encoder = SREncoder(setting=SRSettings(output_format="jpeg", output_quality=80))
+
+    assert parse_accept("image/webp;q=0.5, image/jpeg") is SROutputFormat.JPEG
+    assert parse_accept("text/html, */*") is None
+
+    options = encoder.options()
+    assert options.format is SROutputFormat.JPEG and options.quality == 80
+
+    options = encoder.options(accept="image/webp, image/png;q=0.9")
+    assert options.format is SROutputFormat.WEBP
+
+    # The query parameter wins over the Accept header
+    options = encoder.options(format=SROutputFormat.PNG, accept="image/webp")
+    assert options.format is SROutputFormat.PNG
+
+    encoder.shutdown()
+
+
+def test_sr_output_encoding():
+    encoder = SREncoder()
+    image = np.random.randint(0, 256, size=(16, 24, 3), dtype=np.uint8)  # BGR
+
+    def encode(**kwargs):
+        return asyncio.run(encoder.encode_async(image, encoder.options(**kwargs)))
+
+    def decode(response):
+        return cv2.imdecode(np.frombuffer(response.body, np.uint8), cv2.IMREAD_COLOR)
+
+    for compression in (0, 9):
+        response = encode(format=SROutputFormat.PNG, compression=compression)
+        assert response.media_type == "image/png"
+        assert np.array_equal(decode(response), image)
+
+    response = encode(format=SROutputFormat.WEBP, lossless=True)
+    assert response.media_type == "image/webp"
+    assert np.array_equal(decode(response), image)
+
+    response = encode(format=SROutputFormat.JPEG, quality=50)
+    assert response.media_type == "image/jpeg"
+    assert decode(response).shape == image.shape
+
+    response = encode(format=SROutputFormat.RAW)
+    assert response.media_type == "application/octet-stream"
+    assert response.headers["X-Image-Shape"] == "16,24,3"
+    raw = np.frombuffer(response.body, np.uint8).reshape(16, 24, 3)
+    assert np.array_equal(raw, image[:, :, ::-1])  # RGB
+
+    encoder.shutdown()
@@ -0,0 +1,454 @@
+import asyncio
+import os
+import threading
+import time
+from queue import Full
+from typing import List
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from server.base.Message import BaseFailed, BaseMessageType, BaseResult, BaseTask
+from server.base.ModelRegistry import ModelRegistry
+from server.base.ProcessWorker import ProcessWorker
+from server.base.ThreadBudget import ThreadAllocation, ThreadBudget, available_cpus
+from server.base.Worker import BaseWorker
+from server.base.WorkerManager import BaseWorkerManager
+from server.config.Settings import DetectionSettings, ServerSettings, SRSettings
+from server.util.types import DeviceType, EngineDevice, SchedulePolicy
+
+
+class EchoResult(BaseResult):
+    data: str
+
+
+class EchoTask(BaseTask):
+    data: str
+    delay: float = 0.0
+
+
+class EchoWorker(BaseWorker):
+    def __init__(self, queue_size: int = -1, device: EngineDevice = None):
+        super().__init__(queue_size=queue_size, device=device or EngineDevice())
+
+    def handle(self, msg: EchoTask):
+        time.sleep(msg.delay)
+        self.emit(EchoResult(task_id=msg.id, data=msg.data))
+
+
+class ArrayTask(BaseTask):
+    data: np.ndarray
+
+
+class ArrayResult(BaseResult):
+    data: np.ndarray
+    pid: int
+
+
+class ArrayWorker(BaseWorker):
+    def __init__(self, queue_size: int = -1, device: EngineDevice = None):
+        super().__init__(queue_size=queue_size, device=device or EngineDevice())
+
+    def handle(self, msg: ArrayTask):
+        self.publish(ArrayResult(task_id=msg.id, data=msg.data[:1], pid=os.getpid()))
+        self.emit(ArrayResult(task_id=msg.id, data=msg.data * 2, pid=os.getpid()))
+
+
+class ExitTask(BaseTask):
+    pass
+
+
+class ExitWorker(EchoWorker):
+    def handle(self, msg: BaseTask):
+        if isinstance(msg, ExitTask):
+            os._exit(1)
+        super().handle(msg)
+
+
+class TorchThreadsWorker(BaseWorker):
+    def __init__(
+        self,
+        queue_size: int = -1,
+        device: EngineDevice = None,
+        threads: ThreadAllocation = None,
+    ):
+        super().__init__(queue_size, device or EngineDevice(), threads=threads)
+
+    def handle(self, msg: EchoTask):
+        self.emit(EchoResult(task_id=msg.id, data=str(torch.get_num_threads())))
+
+
+class EchoWorkerManager(BaseWorkerManager):
+    def init(self):
+        workers: List[BaseWorker] = []
+        for device in self.worker_devices:
+            worker = EchoWorker(device=device)
+            worker.start()
+            workers.append(worker)
+
+        self.workers = tuple(workers)
+
+
+def start_worker(worker: BaseWorker) -> BaseWorker:
+    worker.start()
+    while not worker.isReady():
+        time.sleep(0.01)
+    return worker
+
+
+def test_worker_submit_resolves_future():
+    worker = start_worker(EchoWorker())
+
+    task = EchoTask(data="hello")
+    result: EchoResult = worker.submit(task).result(timeout=5)
+
+    assert result.type == BaseMessageType.RETURN_RESULT
+    assert result.task_id == task.id
+    assert result.data == "hello"
+
+    worker.stop()
+    worker.join()
+
+
+def test_worker_submit_async():
+    worker = start_worker(EchoWorker())
+
+    async def run() -> List[EchoResult]:
+        tasks = [EchoTask(data=str(i), delay=0.01) for i in range(16)]
+        futures = [asyncio.wrap_future(worker.submit(t)) for t in tasks]
+
+        # The event loop must stay responsive while the worker is busy
+        await asyncio.sleep(0)
+        return await asyncio.gather(*futures)
+
+    results = asyncio.run(run())
+
+    assert [r.data for r in results] == [str(i) for i in range(16)]
+
+    worker.stop()
+    worker.join()
+
+
+def test_registry_routes_results_by_task_id():
+    worker = start_worker(EchoWorker())
+
+    slow = EchoTask(data="slow", delay=0.2)
+    fast = EchoTask(data="fast")
+
+    slow_future = worker.submit(slow)
+    fast_future = worker.submit(fast)
+
+    assert worker.outstanding() >= 1
+    assert fast_future.result(timeout=5).data == "fast"
+    assert slow_future.result(timeout=5).data == "slow"
+    assert worker.outstanding() == 0
+
+    worker.stop()
+    worker.join()
+
+
+def test_registry_fails_outstanding_on_stop():
+    worker = start_worker(EchoWorker())
+
+    busy = worker.submit(EchoTask(data="busy", delay=0.5))
+    queued = worker.submit(EchoTask(data="queued"))
+    worker.stop()
+    worker.join()
+
+    assert busy.result(timeout=5).data == "busy"
+    assert queued.result(timeout=5).type == BaseMessageType.FAILED
+
+
+def test_submit_to_stopped_worker_fails():
+    worker = start_worker(EchoWorker())
+    worker.stop()
+    worker.join()
+
+    future = worker.submit(EchoTask(data="late"))
+    assert future.result(timeout=1).type == BaseMessageType.FAILED
+    assert worker.outstanding() == 0
+
+    class BrokenWorker(EchoWorker):
+        def init(self):
+            raise RuntimeError("init failed")
+
+    worker = start_worker(BrokenWorker())
+    assert worker.isReady()
+    future = worker.submit(EchoTask(data="never"))
+    assert future.result(timeout=1).type == BaseMessageType.FAILED
+    worker.join()
+
+
+def test_worker_manager_metrics():
+    manager = EchoWorkerManager(worker_num=2)
+
+    manager.next().submit(EchoTask(data="hello")).result(timeout=5)
+    metrics = manager.metrics()
+
+    assert [m["id"] for m in metrics] == [w.id for w in manager.workers]
+    assert all(m["outstanding"] == 0 for m in metrics)
+    assert sum(m["latency"] is not None for m in metrics) == 1
+    manager.stop()
+
+
+def test_batch_latency_is_per_task():
+    class BatchWorker(EchoWorker):
+        def handle(self, msg: EchoTask):
+            batch = [msg]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            time.sleep(0.2)
+            for task in batch:
+                self.emit(EchoResult(task_id=task.id, data=task.data))
+
+    worker = BatchWorker()
+    futures = [worker.submit(EchoTask(data=str(i))) for i in range(4)]
+    start_worker(worker)
+    for f in futures:
+        f.result(timeout=5)
+
+    # One sample of 200 ms shared by the 4 tasks of the batch
+    assert 40 <= worker.latency <= 120
+
+    worker.stop()
+    worker.join()
+
+
+def test_round_robin_policy():
+    manager = EchoWorkerManager(worker_num=3)
+
+    picked = [manager.next() for _ in range(6)]
+
+    assert picked == list(manager.workers) * 2
+    manager.stop()
+
+
+def test_least_outstanding_policy():
+    manager = EchoWorkerManager(worker_num=3, policy=SchedulePolicy.LEAST_OUTSTANDING)
+
+    busy = manager.next()
+    future = busy.submit(EchoTask(data="long", delay=0.5))
+
+    for _ in range(4):
+        assert manager.next() is not busy
+
+    future.result(timeout=5)
+    manager.stop()
+
+
+def test_shortest_expected_policy():
+    manager = EchoWorkerManager(worker_num=2, policy=SchedulePolicy.SHORTEST_EXPECTED)
+
+    slow, fast = manager.workers
+    slow.latency, fast.latency = 1000, 10
+
+    futures = [fast.submit(EchoTask(data=str(i), delay=0.2)) for i in range(3)]
+
+    # 4 x 10 ms queued on the fast worker still beats 1 x 1000 ms
+    assert manager.next() is fast
+
+    for f in futures:
+        f.result(timeout=5)
+    manager.stop()
+
+
+def test_device_balance_policy():
+    devices = [EngineDevice(), EngineDevice()]
+    devices[1].id = 1  # Distinct device identity without requiring a GPU
+    devices[1].mode = DeviceType.GPU
+
+    manager = EchoWorkerManager(
+        worker_num=4, devices=devices, policy=SchedulePolicy.DEVICE_BALANCE
+    )
+
+    busy = manager.workers[0]
+    future = busy.submit(EchoTask(data="long", delay=0.5))
+
+    # Device of worker 0 is loaded, so both picks land on the other device
+    for _ in range(2):
+        assert str(manager.next().device) != str(busy.device)
+
+    future.result(timeout=5)
+    manager.stop()
+
+
+def test_model_registry_shares_per_device():
+    loaded: List[str] = []
+
+    def load(device: EngineDevice):
+        time.sleep(0.1)  # Concurrent acquires must wait instead of loading twice
+        loaded.append(str(device))
+        return object()
+
+    registry = ModelRegistry(factory=load)
+    cpu = EngineDevice()
+    gpu = EngineDevice()
+    gpu.id, gpu.mode = 1, DeviceType.GPU
+
+    models = []
+    threads = [
+        threading.Thread(target=lambda d=d: models.append((d, registry.acquire(d))))
+        for d in [cpu, cpu, cpu, gpu]
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(loaded) == ["cpu", "cuda:1"]
+    assert len({id(m) for d, m in models if d is cpu}) == 1
+    assert registry.refs(cpu) == 3 and len(registry) == 2
+
+    for _ in range(3):
+        registry.release(cpu)
+    assert registry.refs(cpu) == 0 and len(registry) == 1
+
+    # Released models are loaded again on the next acquire
+    registry.acquire(cpu)
+    assert loaded.count("cpu") == 2
+
+
+def test_pool_settings_fall_back_to_server():
+    server = ServerSettings(devices="cpu", worker_num=3, worker_queue_size=10)
+
+    sr = SRSettings()
+    assert sr.workers(server) == ["cpu"] * 3
+    assert sr.queue_size(server) == 10
+
+    detection = DetectionSettings(
+        worker_num="cpu:2", worker_queue_size=4, worker_batch_size=8
+    )
+    assert detection.workers(server) == ["cpu"] * 2
+    assert detection.queue_size(server) == 4
+    assert detection.batch_size(server) == 8
+    assert detection.batch_timeout(server) == server.worker_batch_timeout
+
+
+def test_worker_manager_per_device_workers():
+    cpu, gpu = EngineDevice(), EngineDevice()
+    gpu.id, gpu.mode = 1, DeviceType.GPU
+
+    manager = EchoWorkerManager(worker_devices=[cpu, gpu, gpu, gpu])
+
+    assert manager.worker_num == 4
+    assert [str(d) for d in manager.devices] == ["cpu", "cuda:1"]
+    assert [str(w.device) for w in manager.workers] == ["cpu"] + ["cuda:1"] * 3
+    manager.stop()
+
+
+def test_thread_budget_splits_cores():
+    budget = ThreadBudget(cpus=list(range(16)), pin=True)
+    plan = budget.allocate({"sr": ["cpu", 0], "detection": ["cpu"] * 3})
+
+    # One core per GPU worker, the other 15 shared by the 4 CPU workers
+    assert [a.intra_op for a in plan["sr"]] == [4, 1]
+    assert [a.intra_op for a in plan["detection"]] == [4, 4, 3]
+    assert all(a.inter_op == 1 and a.opencv == 3 for a in plan["sr"])
+
+    cpus = [cpu for allocations in plan.values() for a in allocations for cpu in a.cpus]
+    assert sorted(cpus) == list(range(16))
+
+    # Oversubscribed machines still give every worker a thread
+    plan = ThreadBudget(cpus=[0, 1]).allocate({"sr": ["cpu"] * 3})
+    assert [a.intra_op for a in plan["sr"]] == [1, 1, 1]
+    assert plan["sr"][0].cpus is None
+
+    shared = ThreadAllocation.merge(
+        [ThreadAllocation(intra_op=2, cpus=[0, 1]), ThreadAllocation(cpus=[2])]
+    )
+    assert shared.intra_op == 3 and shared.cpus == [0, 1, 2]
+
+
+def test_worker_applies_thread_allocation():
+    class ThreadsWorker(EchoWorker):
+        def init(self):
+            self.observed = (
+                torch.get_num_threads(),
+                cv2.getNumThreads(),
+                sorted(os.sched_getaffinity(0)),
+            )
+
+    torch_threads, cv2_threads = torch.get_num_threads(), cv2.getNumThreads()
+    cpus = available_cpus()[:2]
+
+    # torch sizes an intra-op team per thread: workers keep their own count
+    workers = [ThreadsWorker(), ThreadsWorker()]
+    for worker, intra_op, cpu in zip(workers, [3, 1], [cpus[0], cpus[-1]]):
+        worker.threads = ThreadAllocation(intra_op=intra_op, opencv=2, cpus=[cpu])
+        start_worker(worker)
+
+    assert [w.observed for w in workers] == [(3, 2, [cpus[0]]), (1, 2, [cpus[-1]])]
+    assert workers[0].metrics()["threads"] == 3
+    assert torch.get_num_threads() == torch_threads
+
+    for worker in workers:
+        worker.stop()
+        worker.join()
+    cv2.setNumThreads(cv2_threads)
+
+
+def test_process_worker():
+    worker = start_worker(ProcessWorker(ArrayWorker, queue_size=-1))
+
+    partials: List[ArrayResult] = []
+    data = np.arange(512 * 512, dtype=np.int32).reshape(512, 512)  # Shared memory
+    futures = [
+        worker.submit(ArrayTask(data=data), listener=lambda r: partials.append(r))
+        for _ in range(3)
+    ]
+    small = worker.submit(ArrayTask(data=data[:2, :2]))  # Sent through the pipe
+
+    results: List[ArrayResult] = [f.result(timeout=30) for f in futures]
+
+    assert all(np.array_equal(r.data, data * 2) for r in results)
+    assert all(r.pid != os.getpid() for r in results)
+    assert len(partials) == 3 and np.array_equal(partials[0].data, data[:1])
+    assert np.array_equal(small.result(timeout=30).data, data[:2, :2] * 2)
+    assert worker.metrics()["pid"] == results[0].pid
+    assert worker.latency is not None  # Measured in the process
+    assert worker.outstanding() == 0
+
+    worker.stop()
+    worker.join()
+
+
+def test_process_worker_bounds_in_flight_tasks():
+    worker = start_worker(ProcessWorker(EchoWorker, queue_size=1))
+
+    future = worker.submit(EchoTask(data="slow", delay=0.5))
+    with pytest.raises(Full):
+        worker.submit(EchoTask(data="rejected"))
+    assert future.result(timeout=30).data == "slow"
+
+    # The slot is free again once the result is back
+    assert worker.submit(EchoTask(data="next")).result(timeout=30).data == "next"
+
+    worker.stop()
+    worker.join()
+
+
+def test_process_worker_fails_tasks_when_process_dies():
+    worker = start_worker(ProcessWorker(ExitWorker, queue_size=-1))
+
+    worker.submit(ExitTask())
+    pending = worker.submit(EchoTask(data="pending"))
+
+    assert isinstance(pending.result(timeout=30), BaseFailed)
+    worker.join(timeout=30)
+    assert worker.is_stopped and not worker.is_alive()
+    assert isinstance(
+        worker.submit(EchoTask(data="late")).result(timeout=1), BaseFailed
+    )
+
+
+def test_process_worker_applies_torch_threads():
+    threads = ThreadAllocation(intra_op=2)
+    worker = start_worker(ProcessWorker(TorchThreadsWorker, threads=threads))
+
+    # A worker owning its process also sizes the torch pool
+    assert worker.submit(EchoTask(data="")).result(timeout=30).data == "2"
+
+    worker.stop()
+    worker.join()
@@ -0,0 +1,386 @@
+import asyncio
+import os
+import time
+from typing import List
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+import server.engine.detection.Worker as worker_module
+from server.base.Message import BaseMessageType
+from server.base.WorkerManager import BaseWorkerManager
+from server.config.Settings import DetectionSettings, Settings
+from server.engine.detection.Benchmark import benchmark
+from server.engine.detection.Engine import DetectionEngine
+from server.engine.detection.Message import (
+    DetectionInputType,
+    DetectionResult,
+    DetectionTask,
+    FrameData,
+)
+from server.engine.detection.Model import DetectionModel, postprocess
+from server.engine.detection.Processor import DetectionProcessor
+from server.engine.detection.Worker import DetectionWorker
+from server.engine.SR.Export import TORCHSCRIPT_EXPORT_OPTIONS
+from server.plugin.yolov7 import letterbox
+from server.util.onnx import optimized_model_path
+from server.util.types import EngineDevice, GraphOptimization
+from server.util.video import VideoBatchReader
+
+
+class FakeDetectionModel:
+    batch_sizes: List[int] = []
+
+    def __init__(self, device, setting=None, threads=None):
+        FakeDetectionModel.batch_sizes = []
+
+    def io_binding(self):
+        return None
+
+    def __call__(
+        self, frames: List[np.ndarray], run_options=None, processor=None, binding=None
+    ):
+        FakeDetectionModel.batch_sizes.append(len(frames))
+        return [
+            FrameData(
+                frame_index=i,
+                boxes=np.array([[0, 0, frame.shape[1], frame.shape[0]]], np.int32),
+                class_ids=np.array([0]),
+                scores=np.array([0.9]),
+                class_names=np.array(["person"], dtype=object),
+            )
+            for i, frame in enumerate(frames)
+        ]
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    monkeypatch.setattr(worker_module, "DetectionModel", FakeDetectionModel)
+    return FakeDetectionModel
+
+
+def encode_image(width: int, height: int) -> bytes:
+    _, data = cv2.imencode(".png", np.zeros((height, width, 3), dtype=np.uint8))
+    return data.tobytes()
+
+
+def test_image_tasks_are_coalesced(fake_model):
+    worker = DetectionWorker(batch_size=4, batch_timeout=200, queue_size=-1)
+
+    tasks = [
+        DetectionTask(
+            input_type=DetectionInputType.IMAGE,
+            image_data=[encode_image(8 + i, 8)],
+        )
+        for i in range(6)
+    ]
+    futures = [worker.submit(task) for task in tasks]
+
+    worker.start()
+    results: List[DetectionResult] = [f.result(timeout=5) for f in futures]
+
+    assert fake_model.batch_sizes == [4, 2]
+    for i, (task, result) in enumerate(zip(tasks, results)):
+        assert result.task_id == task.id
+        assert len(result.data) == 1
+        assert result.data[0].frame_index == 0
+        assert result.data[0].patches[0].box.x2 == 8 + i
+
+    worker.stop()
+    worker.join()
+
+
+def test_invalid_image_fails_only_its_task(fake_model):
+    worker = DetectionWorker(batch_size=4, batch_timeout=200, queue_size=-1)
+
+    valid = DetectionTask(
+        input_type=DetectionInputType.IMAGE, image_data=[encode_image(8, 8)]
+    )
+    invalid = DetectionTask(
+        input_type=DetectionInputType.IMAGE, image_data=[b"not an image"]
+    )
+    valid_future = worker.submit(valid)
+    invalid_future = worker.submit(invalid)
+
+    worker.start()
+
+    assert valid_future.result(timeout=5).type == BaseMessageType.RETURN_RESULT
+    assert invalid_future.result(timeout=5).type == BaseMessageType.FAILED
+    assert fake_model.batch_sizes == [1]
+
+    worker.stop()
+    worker.join()
+
+
+def test_postprocess_groups_by_frame():
+    # batch_id, x0, y0, x1, y1, class_id, score in letterboxed coordinates
+    output = np.array(
+        [
+            [2, 20, 40, 60, 80, 2, 0.51234],
+            [0, 10, 20, 30, 40, 0, 0.9],
+            [2, 0, 0, 40, 40, 1, 0.25],
+        ],
+        dtype=np.float32,
+    )
+    ratios = np.array([1.0, 1.0, 2.0])
+    dwdhs = np.array([[0.0, 0.0], [0.0, 0.0], [10.0, 20.0]])
+
+    frames = postprocess(output, ratios, dwdhs, num_frames=4)
+
+    assert [f.frame_index for f in frames] == [0, 1, 2, 3]
+    assert [len(f) for f in frames] == [1, 0, 2, 0]
+    assert frames[0].boxes.tolist() == [[10, 20, 30, 40]]
+    assert frames[2].boxes.tolist() == [[5, 10, 25, 30], [-5, -10, 15, 10]]
+    assert frames[2].class_names.tolist() == ["car", "bicycle"]
+
+    patch = frames[2].patches[0]
+    assert patch.score == 0.512
+    assert patch.class_id == 2
+    assert patch.box.x2 == 25
+    assert frames[1].patches == []
+
+
+def letterbox_batch(frames: List[np.ndarray]):
+    images, ratios, dwdhs = zip(*[letterbox(f.copy(), auto=False) for f in frames])
+    batch = np.stack(images).transpose((0, 3, 1, 2)).astype(np.float32) / 255
+    return batch, np.array(ratios), np.array(dwdhs)
+
+
+def test_processor_matches_letterbox():
+    processor = DetectionProcessor()
+    rng = np.random.default_rng(0)
+    batches = [
+        [(480, 640), (480, 640), (640, 480)],
+        [(720, 1280), (640, 640)],  # Reused slots with a new layout
+        [(100, 50), (720, 1280), (640, 640), (33, 77)],
+    ]
+
+    for shapes in batches:
+        frames = [
+            rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8) for h, w in shapes
+        ]
+        batch, ratios, dwdhs = processor.pre_process(frames)
+        expected, expected_ratios, expected_dwdhs = letterbox_batch(frames)
+
+        assert batch.dtype == np.float32 and batch.flags["C_CONTIGUOUS"]
+        assert np.array_equal(batch, expected)
+        assert np.allclose(ratios, expected_ratios)
+        assert np.allclose(dwdhs, expected_dwdhs)
+
+
+class TinyDetector(torch.nn.Module):
+    """One detection per frame, derived from its mean, in the NMS output layout."""
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        mean = images.mean(dim=(1, 2, 3))
+        ids = torch.arange(images.shape[0], dtype=images.dtype)
+        boxes = torch.stack([mean * 100, mean * 200, mean * 300, mean * 400], dim=1)
+        scores = mean[:, None]
+        return torch.cat([ids[:, None], boxes, torch.zeros_like(scores), scores], 1)
+
+
+def export_tiny_detector(path: str):
+    torch.onnx.export(
+        TinyDetector(),
+        (torch.rand(2, 3, 640, 640),),
+        path,
+        input_names=["images"],
+        output_names=["output"],
+        dynamic_axes={"images": {0: "batch"}, "output": {0: "detections"}},
+        **TORCHSCRIPT_EXPORT_OPTIONS,
+    )
+
+
+@pytest.fixture
+def tiny_detection_model(tmp_path) -> DetectionModel:
+    path = str(tmp_path / "detector.onnx")
+    export_tiny_detector(path)
+    return DetectionModel(
+        device=EngineDevice(), path=path, setting=DetectionSettings(onnx_cache_dir="")
+    )
+
+
+def test_io_binding_matches_run(tiny_detection_model):
+    model = tiny_detection_model
+    processor = DetectionProcessor()
+    binding = model.io_binding()
+    rng = np.random.default_rng(0)
+
+    for batch_size in [4, 4, 2, 4]:
+        frames = [
+            rng.integers(0, 256, size=(240, 320, 3), dtype=np.uint8)
+            for _ in range(batch_size)
+        ]
+        expected = model(frames, processor=processor)
+        output = model(frames, processor=processor, binding=binding)
+
+        assert len(output) == batch_size
+        for frame, reference in zip(output, expected):
+            assert np.array_equal(frame.boxes, reference.boxes)
+            assert np.array_equal(frame.scores, reference.scores)
+
+    # Bound once per batch shape, then reused
+    assert len(binding) == 2
+
+    results = benchmark(model, frames, iterations=2)
+    assert set(results.keys()) == {"run", "io_binding"}
+
+
+def test_optimized_graph_cache(tmp_path):
+    path = str(tmp_path / "detector.onnx")
+    export_tiny_detector(path)
+    cache_dir = str(tmp_path / "cache")
+    device = EngineDevice()
+
+    frames = [np.full((240, 320, 3), 128, dtype=np.uint8)]
+    setting = DetectionSettings(onnx_cache_dir=cache_dir)
+    expected = DetectionModel(device=device, path=path, setting=setting)(frames)
+
+    cache_path = optimized_model_path(path, device, GraphOptimization.ALL, cache_dir)
+    assert os.listdir(cache_dir) == [os.path.basename(cache_path)]
+
+    # The second model loads the cached graph
+    output = DetectionModel(device=device, path=path, setting=setting)(frames)
+    assert np.array_equal(output[0].boxes, expected[0].boxes)
+    assert os.listdir(cache_dir) == [os.path.basename(cache_path)]
+
+    assert cache_path != optimized_model_path(
+        path, device, GraphOptimization.BASIC, cache_dir
+    )
+
+
+def test_optimized_graph_cache_unwritable(tmp_path):
+    path = str(tmp_path / "detector.onnx")
+    export_tiny_detector(path)
+
+    # Existing but read-only: sessions are still created, without a cache
+    for cache_dir in ["/proc", "/proc/self"]:
+        setting = DetectionSettings(onnx_cache_dir=cache_dir)
+        model = DetectionModel(device=EngineDevice(), path=path, setting=setting)
+        assert len(model([np.zeros((64, 64, 3), dtype=np.uint8)])) == 1
+
+
+def write_video(path: str, num_frames: int, width: int = 32, height: int = 24):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (width, height))
+    for i in range(num_frames):
+        writer.write(np.full((height, width, 3), i, dtype=np.uint8))
+    writer.release()
+
+
+def test_video_batch_reader(tmp_path):
+    video_path = str(tmp_path / "sample.avi")
+    write_video(video_path, num_frames=10)
+
+    with VideoBatchReader(path=video_path, batch_size=4, prefetch=1) as reader:
+        batches = [len(batch) for batch in reader]
+
+    assert batches == [4, 4, 2]
+
+
+def test_video_batch_reader_close_early(tmp_path):
+    video_path = str(tmp_path / "sample.avi")
+    write_video(video_path, num_frames=20)
+
+    with VideoBatchReader(path=video_path, batch_size=2, prefetch=1) as reader:
+        for _ in reader:
+            break
+
+
+def test_video_is_processed_in_batches(fake_model, tmp_path):
+    video_path = str(tmp_path / "sample.avi")
+    write_video(video_path, num_frames=10)
+
+    worker = DetectionWorker(batch_size=4, queue_size=-1)
+    task = DetectionTask(input_type=DetectionInputType.VIDEO, video_path=video_path)
+    future = worker.submit(task)
+
+    worker.start()
+    result: DetectionResult = future.result(timeout=10)
+
+    assert fake_model.batch_sizes == [4, 4, 2]
+    assert [d.frame_index for d in result.data] == list(range(10))
+    assert all(len(d.patches) == 1 for d in result.data)
+
+    worker.stop()
+    worker.join()
+
+
+class FakeDetectionWorkerManager(BaseWorkerManager):
+    def init(self):
+        worker = DetectionWorker(batch_size=4, queue_size=-1)
+        worker.start()
+        self.workers = (worker,)
+
+
+def test_video_stream_yields_batches(fake_model, tmp_path):
+    video_path = str(tmp_path / "sample.avi")
+    write_video(video_path, num_frames=10)
+
+    manager = FakeDetectionWorkerManager()
+    engine = DetectionEngine(setting=None, worker_manager=manager)
+
+    async def run() -> List[DetectionResult]:
+        task = DetectionTask(input_type=DetectionInputType.VIDEO, video_path=video_path)
+        return [result async for result in engine.stream(task)]
+
+    results = asyncio.run(run())
+
+    # Three partial batches and an empty final result
+    assert [len(r.data) for r in results] == [4, 4, 2, 0]
+    assert [d.frame_index for r in results for d in r.data] == list(range(10))
+
+    engine.stop()
+
+
+def test_video_stream_stops_when_abandoned(fake_model, tmp_path):
+    video_path = str(tmp_path / "sample.avi")
+    write_video(video_path, num_frames=40)
+
+    manager = FakeDetectionWorkerManager()
+    engine = DetectionEngine(setting=None, worker_manager=manager)
+
+    async def run():
+        task = DetectionTask(input_type=DetectionInputType.VIDEO, video_path=video_path)
+        results = engine.stream(task)
+        async for _ in results:
+            break
+        await results.aclose()
+
+    asyncio.run(run())
+
+    worker = manager.workers[0]
+    deadline = time.monotonic() + 10
+    while worker.outstanding() > 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert worker.outstanding() == 0
+
+    assert sum(fake_model.batch_sizes) < 40
+
+    engine.stop()
+
+
+def test_video_stream_cancelled_when_stalled(fake_model, tmp_path):
+    video_path = str(tmp_path / "sample.avi")
+    write_video(video_path, num_frames=40)
+
+    manager = FakeDetectionWorkerManager()
+    setting = Settings(detection=DetectionSettings(stream_stall_timeout=0.2))
+    engine = DetectionEngine(setting=setting, worker_manager=manager)
+
+    async def run() -> List[DetectionResult]:
+        task = DetectionTask(input_type=DetectionInputType.VIDEO, video_path=video_path)
+        results = []
+        async for result in engine.stream(task):
+            results.append(result)
+            if len(results) == 1:
+                await asyncio.sleep(1.0)  # Stop reading while the worker waits
+        return results
+
+    results = asyncio.run(run())
+
+    assert results[-1].type == BaseMessageType.FAILED
+    assert sum(fake_model.batch_sizes) < 40
+
+    engine.stop()
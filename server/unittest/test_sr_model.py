@@ -0,0 +1,426 @@
+import glob
+import os
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from server.config.Settings import SRSettings
+from server.engine.SR.Export import export_onnx
+from server.engine.SR.Model import (
+    CompiledNetwork,
+    OnnxNetwork,
+    SRModel,
+    TracedNetwork,
+    autocast,
+    cast_network,
+    tile_windows,
+)
+from server.engine.SR.Processor import SRProcessor
+from server.plugin.HAT.hat.models.hat_model import HATModel
+from server.util.types import DeviceType, EngineDevice, Precision
+
+PRETRAINED_MODEL = "server/plugin/HAT/pretrained/HAT-L_SRx4_ImageNet-pretrain.pth"
+PRETRAINED_ONNX_MODEL = "server/plugin/HAT/pretrained/HAT-L_SRx4_ImageNet-pretrain.onnx"
+
+
+def prepare_tiny_hat_model(
+    tile_size: int, tile_pad: int, batch_size: int, feather: bool = False
+):
+    options = {
+        "is_train": False,
+        "dist": False,
+        "num_gpu": 0,
+        "scale": 2,
+        "network_g": {
+            "type": "HAT",
+            "upscale": 2,
+            "in_chans": 3,
+            "img_size": 16,
+            "window_size": 16,
+            "compress_ratio": 3,
+            "squeeze_factor": 3,
+            "conv_scale": 0.01,
+            "overlap_ratio": 0.5,
+            "img_range": 1.0,
+            "depths": [2],
+            "embed_dim": 24,
+            "num_heads": [2],
+            "mlp_ratio": 2,
+            "upsampler": "pixelshuffle",
+            "resi_connection": "1conv",
+        },
+        "path": {},
+        "tile": {
+            "tile_size": tile_size,
+            "tile_pad": tile_pad,
+            "batch_size": batch_size,
+            "feather": feather,
+        },
+    }
+    torch.manual_seed(0)
+    return HATModel(options, device="cpu")
+
+
+def run(model: HATModel, input: torch.Tensor, tile: bool) -> torch.Tensor:
+    model.lq = input
+    model.pre_process()
+    if tile:
+        model.tile_process()
+    else:
+        model.process()
+    model.post_process()
+    return model.output
+
+
+def test_tile_process_matches_whole_image():
+    # A pad covering the whole image gives every tile the full receptive field
+    model = prepare_tiny_hat_model(tile_size=16, tile_pad=64, batch_size=4)
+    input = torch.rand(1, 3, 48, 64)
+
+    expected = run(model, input, tile=False)
+    output = run(model, input, tile=True)
+
+    assert output.shape == (1, 3, 96, 128)
+    assert torch.allclose(output, expected, atol=1e-5)
+
+
+def test_tile_process_batch_size_invariant():
+    input = torch.rand(1, 3, 64, 64)
+
+    model = prepare_tiny_hat_model(tile_size=16, tile_pad=16, batch_size=1)
+    serial = run(model, input, tile=True)
+
+    model.opt["tile"]["batch_size"] = 8
+    batched = run(model, input, tile=True)
+
+    assert torch.allclose(serial, batched, atol=1e-5)
+
+
+def stitch(
+    model: HATModel,
+    input: torch.Tensor,
+    windows_y: List[Tuple[int, int, int]],
+    windows_x: List[Tuple[int, int, int]],
+    window: Tuple[int, int],
+    ramp: Optional[int] = None,
+) -> torch.Tensor:
+    """Upscale `input` tile by tile with explicit (start, core start, core end)
+    windows per axis, blending each tile with weights of the `ramp` width.
+    """
+    scale = model.opt["scale"]
+    _, _, height, width = input.shape
+    output = torch.zeros(1, 3, height * scale, width * scale)
+    weight_sum = torch.zeros(height * scale, width * scale)
+
+    def weights(start: int, core_start: int, core_end: int, size: int):
+        positions = start * scale + torch.arange(size * scale)
+        distance = torch.maximum(
+            core_start * scale - positions, positions - (core_end * scale - 1)
+        ).clamp(min=0)
+        if ramp is None:
+            return (distance == 0).float()
+        return (1 - distance / ramp).clamp(min=0)
+
+    model.net_g.eval()
+    for y0, core_y0, core_y1 in windows_y:
+        for x0, core_x0, core_x1 in windows_x:
+            tile = input[:, :, y0 : y0 + window[0], x0 : x0 + window[1]]
+            with torch.no_grad():
+                upscaled = model.net_g(tile)
+
+            weight = (
+                weights(y0, core_y0, core_y1, window[0])[:, None]
+                * weights(x0, core_x0, core_x1, window[1])[None, :]
+            )
+            rows = slice(y0 * scale, (y0 + window[0]) * scale)
+            cols = slice(x0 * scale, (x0 + window[1]) * scale)
+            output[:, :, rows, cols] += upscaled * weight
+            weight_sum[rows, cols] += weight
+
+    return output / weight_sum
+
+
+def test_tile_process_uneven_tiles():
+    # Border tiles are shifted inwards so that every window has the same shape
+    model = prepare_tiny_hat_model(tile_size=32, tile_pad=16, batch_size=4)
+    input = torch.rand(1, 3, 48, 80)
+
+    output = run(model, input, tile=True)
+
+    # 48 x 64 windows: rows are clamped to the image, the last column of tiles
+    # starts at 16 instead of 48
+    expected = stitch(
+        model,
+        input,
+        windows_y=[(0, 0, 32), (0, 32, 48)],
+        windows_x=[(0, 0, 32), (16, 32, 64), (16, 64, 80)],
+        window=(48, 64),
+    )
+    assert output.shape == (1, 3, 96, 160)
+    assert torch.allclose(output, expected, atol=1e-5)
+
+
+def test_tile_process_feather():
+    model = prepare_tiny_hat_model(
+        tile_size=16, tile_pad=16, batch_size=4, feather=True
+    )
+    input = torch.rand(1, 3, 64, 80)
+
+    output = run(model, input, tile=True)
+
+    # 48 x 48 windows, weights ramp down over the 16 px pad (32 upscaled)
+    expected = stitch(
+        model,
+        input,
+        windows_y=[(0, 0, 16), (0, 16, 32), (16, 32, 48), (16, 48, 64)],
+        windows_x=[(0, 0, 16), (0, 16, 32), (16, 32, 48), (32, 48, 64), (32, 64, 80)],
+        window=(48, 48),
+        ramp=16 * 2 + 1,
+    )
+    assert torch.allclose(output, expected, atol=1e-5)
+
+    # Blending differs from cutting at the tile cores
+    model.opt["tile"]["feather"] = False
+    assert not torch.allclose(run(model, input, tile=True), output, atol=1e-4)
+
+
+def test_attention_mask_cache():
+    model = prepare_tiny_hat_model(tile_size=16, tile_pad=16, batch_size=4)
+    net = model.get_bare_model(model.net_g)
+    net.mask_cache_size = 2
+
+    for size in [(32, 32), (32, 32), (48, 32), (64, 32), (32, 32)]:
+        run(model, torch.rand(1, 3, *size), tile=False)
+
+    info = net.mask_cache_info()
+    assert info["hits"] == 1
+    assert info["misses"] == 4  # (32, 32) was evicted by the two newer sizes
+    assert info["size"] == 2
+
+    expected = net.calculate_mask((32, 32))
+    assert torch.equal(
+        net.get_mask((32, 32), torch.device("cpu"), expected.dtype), expected
+    )
+
+
+def test_shape_buckets():
+    model = prepare_tiny_hat_model(tile_size=16, tile_pad=16, batch_size=4)
+    model.opt["buckets"] = [32, 64]
+    net = model.get_bare_model(model.net_g)
+
+    for h, w in [(20, 40), (30, 50), (32, 64), (10, 60)]:
+        model.lq = torch.rand(1, 3, h, w)
+        model.pre_process(bucket=True)
+        assert model.img.shape == (1, 3, 32, 64)
+
+        model.process()
+        model.post_process()
+        assert model.output.shape == (1, 3, h * 2, w * 2)
+
+    # Beyond the largest bucket inputs are only padded to the window size
+    model.lq = torch.rand(1, 3, 72, 20)
+    model.pre_process(bucket=True)
+    assert model.img.shape == (1, 3, 80, 32)
+
+    assert net.mask_cache_info()["misses"] == 1
+
+
+def test_sr_processor_round_trip():
+    processor = SRProcessor(device=EngineDevice())
+
+    image = np.random.randint(0, 256, size=(24, 40, 3), dtype=np.uint8)  # BGR
+    _, encoded = cv2.imencode(".png", image)
+
+    decoded = processor.decode(encoded.tobytes())
+    assert np.array_equal(decoded, image)
+
+    tensor = processor.pre_process(decoded)
+    assert tensor.shape == (1, 3, 24, 40)
+    assert tensor.dtype == torch.float32
+    assert torch.allclose(tensor[0, 0], torch.from_numpy(image[:, :, 2]) / 255.0)
+
+    # Out of range model outputs are clamped before quantisation
+    tensor[0, 1, 0, 0] = 1.5
+    output = processor.post_process(tensor)
+    assert output.dtype == np.uint8
+    assert output[0, 0, 1] == 255
+    output[0, 0, 1] = image[0, 0, 1]
+    assert np.array_equal(output, image)
+
+
+def test_sr_processor_ignores_exif_orientation():
+    image = Image.fromarray(np.zeros((24, 40, 3), dtype=np.uint8))
+    exif = image.getexif()
+    exif[0x0112] = 6  # Orientation: rotate 90 CW
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", exif=exif)
+
+    assert SRProcessor.decode(buffer.getvalue()).shape == (24, 40, 3)
+
+
+def test_traced_network():
+    model = prepare_tiny_hat_model(tile_size=16, tile_pad=16, batch_size=2)
+    input = torch.rand(1, 3, 48, 64)
+    expected = run(model, input, tile=True)
+
+    network = TracedNetwork(model.net_g)
+    network.trace(torch.zeros(2, 3, 48, 48))  # Full tile batch
+    model.net_g = network
+
+    output = run(model, input, tile=True)
+
+    # 12 tiles in batches of 2 all run the trace, the whole image runs eagerly
+    assert list(network.traces.keys()) == [(2, 3, 48, 48)]
+    assert torch.allclose(output, expected, atol=1e-5)
+    assert torch.allclose(
+        run(model, input, tile=False), network.network(input), atol=1e-5
+    )
+
+
+def test_compiled_network():
+    network = torch.nn.Conv2d(3, 3, 3, padding=1).eval()
+    compiled = CompiledNetwork(network)
+    compiled.compile(torch.zeros(2, 3, 16, 16))
+
+    # Unwarmed shapes run eagerly instead of compiling on the request path
+    frames = torch._dynamo.utils.counters["stats"]["unique_graphs"]
+    input = torch.rand(1, 3, 16, 32)
+    with torch.no_grad():
+        assert torch.allclose(compiled(input), network(input), atol=1e-5)
+        compiled(torch.rand(2, 3, 16, 16))
+    assert torch._dynamo.utils.counters["stats"]["unique_graphs"] == frames
+    assert compiled.shapes == {(2, 3, 16, 16)}
+
+
+def test_tile_windows_cover_narrow_images():
+    model = prepare_tiny_hat_model(tile_size=16, tile_pad=16, batch_size=2)
+    windows = tile_windows(tile_size=16, tile_pad=16, window_size=16, tile_threshold=0)
+
+    shapes = []
+    network = model.net_g
+
+    class Recorder(torch.nn.Module):
+        def forward(self, input: torch.Tensor) -> torch.Tensor:
+            shapes.append(tuple(input.shape[2:]))
+            return network(input)
+
+    model.net_g = Recorder()
+    for size in [(32, 128), (128, 16), (48, 64)]:
+        run(model, torch.rand(1, 3, *size), tile=True)
+
+    assert set(shapes) == {(32, 48), (48, 16), (48, 48)}
+    assert set(shapes) <= set(windows)
+
+
+def test_onnx_network_parity(tmp_path):
+    model = prepare_tiny_hat_model(tile_size=16, tile_pad=16, batch_size=4)
+    inputs = [torch.rand(1, 3, 48, 64), torch.rand(1, 3, 40, 30)]
+    expected = [(run(model, x, tile=False), run(model, x, tile=True)) for x in inputs]
+
+    path = str(tmp_path / "hat.onnx")
+    export_onnx(model.net_g, path)
+    model.net_g = OnnxNetwork(path=path, device=EngineDevice(), scale=2)
+
+    # Dynamic sizes, and batches of tiles
+    for input, (whole, tiled) in zip(inputs, expected):
+        assert torch.allclose(run(model, input, tile=False), whole, atol=1e-4)
+        assert torch.allclose(run(model, input, tile=True), tiled, atol=1e-4)
+
+
+def psnr(output: np.ndarray, expected: np.ndarray) -> float:
+    mse = np.mean((output.astype(np.float64) - expected.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0**2 / mse)
+
+
+def prepare_sample_images(size: int = 48):
+    images = []
+    for path in sorted(glob.glob("server/unittest/sample/SR/*")):
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append(image[:size, :size])
+    return images
+
+
+def available_precisions():
+    device = EngineDevice(device_str="0" if torch.cuda.is_available() else "cpu")
+    if device.mode is DeviceType.GPU:
+        return device, [Precision.FP16, Precision.BF16]
+    return device, [Precision.BF16]
+
+
+def test_reduced_precision_parity():
+    device, precisions = available_precisions()
+    processor = SRProcessor(device=device)
+    model = prepare_tiny_hat_model(tile_size=16, tile_pad=16, batch_size=4)
+    model.net_g.to(device.torch())
+
+    images = prepare_sample_images()
+    assert len(images) > 0
+    inputs = [processor.pre_process(image) for image in images]
+    expected = [processor.post_process(run(model, x, tile=False)) for x in inputs]
+
+    for precision in precisions:
+        model.net_g = cast_network(model.net_g, precision)
+        assert next(model.net_g.parameters()).dtype == precision.torch()
+
+        for input, reference in zip(inputs, expected):
+            with autocast(device, precision):
+                output = run(model, input, tile=False)
+            assert psnr(processor.post_process(output.float()), reference) > 35
+
+        model.net_g = cast_network(model.net_g.float(), Precision.FP32)
+
+
+@pytest.mark.skipif(
+    not os.path.exists(PRETRAINED_MODEL), reason="Pretrained HAT-L not available"
+)
+def test_sr_model_precision_parity():
+    device, precisions = available_precisions()
+    processor = SRProcessor(device=device)
+
+    images = prepare_sample_images(size=64)
+    reference = SRModel(device=device, setting=SRSettings())
+    expected = [
+        processor.post_process(reference(processor.pre_process(image)))
+        for image in images
+    ]
+    del reference
+
+    for precision in precisions:
+        setting = (
+            SRSettings(precision_cpu=precision)
+            if device.mode is DeviceType.CPU
+            else SRSettings(precision_gpu=precision)
+        )
+        model = SRModel(device=device, setting=setting)
+        assert model.precision is precision
+
+        for image, target in zip(images, expected):
+            output = processor.post_process(model(processor.pre_process(image)))
+            assert psnr(output, target) > 35
+
+
+@pytest.mark.skipif(
+    not os.path.exists(PRETRAINED_MODEL) or not os.path.exists(PRETRAINED_ONNX_MODEL),
+    reason="Pretrained HAT-L and its ONNX export not available",
+)
+def test_sr_model_onnx_parity():
+    device = EngineDevice()
+    processor = SRProcessor(device=device)
+
+    images = prepare_sample_images(size=64)
+    model = SRModel(device=device, setting=SRSettings(backend="torch"))
+    expected = [
+        processor.post_process(model(processor.pre_process(image))) for image in images
+    ]
+    del model
+
+    model = SRModel(device=device, setting=SRSettings(backend="onnx"))
+    for image, target in zip(images, expected):
+        output = processor.post_process(model(processor.pre_process(image)))
+        assert psnr(output, target) > 50
@@ -55,8 +55,7 @@ def run_worker(
             output_dir=output_dir, output_basedir=output_basedir, image=request.data
         )
 
-        worker.push(task)
-        results.append(worker.sink.get())
+        results.append(worker.submit(task).result())
 
     worker.stop()
 
@@ -55,8 +55,7 @@ def run_worker_manager(
         )
 
         worker: BaseWorker = worker_manager.next()
-        worker.push(task)
-        results.append(worker.sink.get())
+        results.append(worker.submit(task).result())
 
     worker_manager.stop()
 
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import threading
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+
+import onnxruntime
+from loguru import logger
+
+from server.base.ThreadBudget import ThreadAllocation
+from server.util.types import DeviceType, EngineDevice, GraphOptimization
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    GraphOptimization.DISABLE: onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    GraphOptimization.BASIC: onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    GraphOptimization.EXTENDED: onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    GraphOptimization.ALL: onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def get_providers(device: EngineDevice) -> List[Any]:
+    """onnxruntime execution providers for `device`."""
+    if device.mode is DeviceType.GPU:
+        return [
+            (
+                "CUDAExecutionProvider",
+                {
+                    "device_id": str(device.id),
+                    "arena_extend_strategy": "kNextPowerOfTwo",
+                    # 'gpu_mem_limit': 2 * 1024 * 1024 * 1024,
+                    "cudnn_conv_algo_search": "EXHAUSTIVE",
+                    "do_copy_in_default_stream": True,
+                },
+            ),
+        ]
+    return ["CPUExecutionProvider"]
+
+
+def get_ort_device(device: EngineDevice) -> Tuple[str, int]:
+    """onnxruntime `(device_type, device_id)` of `device`, for OrtValues."""
+    if device.mode is DeviceType.GPU:
+        return "cuda", device.id
+    return "cpu", 0
+
+
+@lru_cache(maxsize=16)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def optimized_model_path(
+    path: str,
+    device: EngineDevice,
+    optimization: GraphOptimization,
+    cache_dir: str,
+) -> str:
+    """Cache file of the optimised graph of `path` for this runtime and device.
+
+    Optimised graphs may contain provider and hardware specific nodes, so the
+    key covers the model content, the provider and the device model as well
+    as the onnxruntime version and the optimisation level.
+    """
+    stat = os.stat(path)
+    provider = get_providers(device)[0]
+    provider = provider[0] if isinstance(provider, tuple) else provider
+
+    key = hashlib.sha256(
+        "|".join(
+            [
+                _file_digest(os.path.abspath(path), stat.st_mtime_ns, stat.st_size),
+                provider,
+                str(device.device_model),
+                onnxruntime.__version__,
+                optimization.value,
+            ]
+        ).encode()
+    ).hexdigest()[:16]
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{name}-{key}.onnx")
+
+
+def create_session(
+    path: str,
+    device: EngineDevice,
+    optimization: GraphOptimization = GraphOptimization.ALL,
+    cache_dir: Optional[str] = None,
+    threads: ThreadAllocation = None,
+) -> onnxruntime.InferenceSession:
+    """Create an inference session, reusing a cached optimised graph if any.
+
+    Without a cached graph the model is optimised as usual and the result is
+    saved to `cache_dir`, so later sessions (other workers, restarts) skip
+    graph optimisation entirely. An empty `cache_dir` disables the cache, as
+    does one that cannot be written. `threads` sizes the intra/inter-op pools
+    of the session.
+    """
+    providers = get_providers(device)
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[optimization]
+    if threads is not None:
+        threads.configure(options)
+
+    if not cache_dir or optimization is GraphOptimization.DISABLE:
+        return onnxruntime.InferenceSession(
+            path, sess_options=options, providers=providers
+        )
+
+    cache_dir = os.path.expanduser(cache_dir)
+    cache_path = optimized_model_path(path, device, optimization, cache_dir)
+    if os.path.exists(cache_path):
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[
+            GraphOptimization.DISABLE
+        ]
+        try:
+            session = onnxruntime.InferenceSession(
+                cache_path, sess_options=options, providers=providers
+            )
+            logger.info(f"Loaded optimised graph {cache_path}")
+            return session
+        except Exception as e:
+            logger.warning(f"Ignoring optimised graph {cache_path}: {e}")
+            options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[optimization]
+
+    # Written aside and renamed, workers may optimise the same model at once
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        if not os.access(cache_dir, os.W_OK):
+            raise PermissionError(f"{cache_dir} is not writable")
+        options.optimized_model_filepath = tmp_path
+    except OSError as e:
+        logger.warning(f"Optimised graph cache {cache_dir} unavailable: {e}")
+
+    try:
+        session = onnxruntime.InferenceSession(
+            path, sess_options=options, providers=providers
+        )
+    except Exception as e:
+        if not options.optimized_model_filepath:
+            raise
+        # onnxruntime fails the whole session when it cannot save the graph
+        logger.warning(f"Failed to save optimised graph {cache_path}: {e}")
+        options.optimized_model_filepath = ""
+        session = onnxruntime.InferenceSession(
+            path, sess_options=options, providers=providers
+        )
+
+    if os.path.exists(tmp_path):
+        try:
+            os.replace(tmp_path, cache_path)
+            logger.info(f"Saved optimised graph {cache_path}")
+        except OSError as e:
+            logger.warning(f"Failed to save optimised graph {cache_path}: {e}")
+            os.remove(tmp_path)
+    return session
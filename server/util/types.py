@@ -13,6 +13,56 @@ class ServerStatus(Enum):
     DOWN = "DOWN"
 
 
+class SchedulePolicy(Enum):
+    ROUND_ROBIN = "round_robin"
+    LEAST_OUTSTANDING = "least_outstanding"
+    SHORTEST_EXPECTED = "shortest_expected"
+    DEVICE_BALANCE = "device_balance"
+
+
+class WorkerBackend(Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+
+class SROutputFormat(Enum):
+    PNG = "png"
+    WEBP = "webp"
+    JPEG = "jpeg"
+    RAW = "raw"
+
+
+class Precision(Enum):
+    FP32 = "fp32"
+    FP16 = "fp16"
+    BF16 = "bf16"
+
+    def torch(self) -> torch.dtype:
+        if self is Precision.FP16:
+            return torch.float16
+        if self is Precision.BF16:
+            return torch.bfloat16
+        return torch.float32
+
+
+class SRBackend(Enum):
+    TORCH = "torch"
+    ONNX = "onnx"
+
+
+class CompileMode(Enum):
+    NONE = "none"
+    TRACE = "trace"  # TorchScript trace per warmup shape
+    COMPILE = "compile"  # torch.compile
+
+
+class GraphOptimization(Enum):
+    DISABLE = "disable"
+    BASIC = "basic"
+    EXTENDED = "extended"
+    ALL = "all"
+
+
 class DeviceType(Enum):
     CPU = "cpu"
     GPU = "cuda"
@@ -0,0 +1,103 @@
+import threading
+from queue import Full, Queue
+from typing import Callable, Iterator, List, Optional
+
+import cv2
+import numpy as np
+
+
+class VideoBatchReader:
+    """Decode a video on a background thread into fixed-size frame batches.
+
+    At most `prefetch` batches are buffered ahead of the consumer, so memory
+    stays constant regardless of video length while decoding of the next
+    batches overlaps with inference on the current one.
+    """
+
+    __capture: cv2.VideoCapture
+    __batch_size: int
+    __transform: Optional[Callable[[np.ndarray], np.ndarray]]
+
+    __queue: Queue
+    __thread: threading.Thread
+    __stopped: threading.Event
+    __error: Optional[Exception]
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 32,
+        prefetch: int = 2,
+        transform: Callable[[np.ndarray], np.ndarray] = None,
+    ):
+        self.__capture = cv2.VideoCapture(path)
+        if not self.__capture.isOpened():
+            raise RuntimeError(f"Failed to open video: {path}")
+
+        self.__batch_size = max(batch_size, 1)
+        self.__transform = transform
+
+        self.__queue = Queue(maxsize=max(prefetch, 1))
+        self.__thread = threading.Thread(target=self.__decode, daemon=True)
+        self.__stopped = threading.Event()
+        self.__error = None
+
+    def start(self):
+        self.__thread.start()
+        return self
+
+    def close(self):
+        self.__stopped.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __put(self, batch: Optional[List[np.ndarray]]) -> bool:
+        # Wake up periodically so that `close()` never waits on a full queue
+        while not self.__stopped.is_set():
+            try:
+                self.__queue.put(batch, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def __decode(self):
+        try:
+            batch: List[np.ndarray] = []
+            while not self.__stopped.is_set():
+                grabbed, frame = self.__capture.read()  # HWC
+                if not grabbed:
+                    break
+
+                if self.__transform is not None:
+                    frame = self.__transform(frame)
+
+                batch.append(frame)
+                if len(batch) >= self.__batch_size:
+                    if not self.__put(batch):
+                        return
+                    batch = []
+
+            if batch:
+                self.__put(batch)
+        except Exception as err:
+            self.__error = err
+        finally:
+            self.__capture.release()
+            self.__put(None)
+
+    def __iter__(self) -> Iterator[List[np.ndarray]]:
+        while True:
+            batch = self.__queue.get()
+            if batch is None:
+                break
+            yield batch
+
+        if self.__error is not None:
+            raise RuntimeError(f"Failed to decode video: {self.__error}")